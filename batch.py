@@ -0,0 +1,193 @@
+"""
+Webサーバーを使わずに、ローカルのPDFをまとめて変換するコマンド
+
+使い方:
+    python batch.py --excel shift.xlsx --output-dir out/ pdfs/                # ディレクトリ内のPDFを1件ずつxlsmに変換
+    python batch.py --excel shift.xlsx --output-dir out/ 'pdfs/2025-04*.pdf'  # globで指定
+    python batch.py --excel shift.xlsx --output-dir out/ --group-size 50 --workers 4 pdfs/
+
+変換が終わった出力はチェックポイントファイル（出力先の .batch_checkpoint.jsonl）に記録し、
+同じ出力先で再実行した場合は完了済みの出力を飛ばして続きから処理する（--restart で最初からやり直す）
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import converter
+import pdf_extractor
+from converter import TEMPLATE_FILE_PATH, ConversionError, convert
+from metrics import ConversionMetrics
+from sheet_names import SHEET_NAME_SCHEME
+from template_cache import TemplateCache
+
+CHECKPOINT_FILE = '.batch_checkpoint.jsonl'
+
+
+def find_pdfs(patterns, recursive=False):
+    """ディレクトリ・globパターン・ファイルのリストから、PDFのパスを重複なく名前順に返す"""
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '**', '*.pdf') if recursive else os.path.join(pattern, '*.pdf')
+        matches = glob.glob(pattern, recursive=recursive) if glob.has_magic(pattern) else [pattern]
+        paths.extend(path for path in matches if os.path.isfile(path) and path.lower().endswith('.pdf'))
+    return sorted(set(paths))
+
+
+def plan_outputs(pdf_paths, group_size):
+    """
+    出力するxlsmごとの (出力ファイル名, PDFのパスのリスト) を返す
+    group_sizeが1の場合はPDFと同じ名前、0の場合は全PDFを1ファイルにまとめる
+    """
+    if group_size == 1:
+        names = {}
+        plans = []
+        for path in pdf_paths:
+            stem = os.path.splitext(os.path.basename(path))[0]
+            # 別のディレクトリに同名のPDFがある場合は番号を付ける
+            count = names.get(stem, 0)
+            names[stem] = count + 1
+            plans.append((f"{stem}.xlsm" if not count else f"{stem}_{count}.xlsm", [path]))
+        return plans
+    size = group_size or max(len(pdf_paths), 1)
+    return [
+        (f"batch_{index + 1:04d}.xlsm", pdf_paths[start:start + size])
+        for index, start in enumerate(range(0, len(pdf_paths), size))
+    ]
+
+
+def load_checkpoint(output_dir):
+    """チェックポイントファイルから、完了済みで出力ファイルが残っている出力の {出力名: PDFのパスのリスト} を返す"""
+    done = {}
+    try:
+        with open(os.path.join(output_dir, CHECKPOINT_FILE), encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # 中断時に書きかけになった行
+                output_file = record.get('file', record['output'])
+                if record.get('status') == 'done' and os.path.exists(os.path.join(output_dir, output_file)):
+                    done[record['output']] = record['pdfs']
+    except OSError:
+        pass
+    return done
+
+
+def _init_worker(template_path):
+    # ファイル単位で並列に処理するため、各ワーカー内のPDF抽出はプロセスプールを使わずに逐次実行する
+    pdf_extractor.PDF_WORKERS = 1
+    converter.template_cache = TemplateCache(template_path)
+
+
+def convert_group(excel_path, pdf_paths, output_path, sheet_name_scheme):
+    """
+    1つの出力ファイル分のPDFを変換する（ワーカープロセスで実行される）
+    書きかけのファイルが残らないよう、一時ファイルに保存してから置き換える
+    戻り値: 結果の記録（チェックポイントに書き出す内容）
+    """
+    started = time.perf_counter()
+    metrics = ConversionMetrics(os.path.basename(output_path))
+    tmp_path = f"{output_path}.tmp"
+    record = {'output': os.path.basename(output_path), 'pdfs': pdf_paths}
+    try:
+        # ExcelとPDFはメモリに読み込まずにパスのまま渡す
+        pdf_sources = [(path, os.path.basename(path)) for path in pdf_paths]
+        result_type = convert(excel_path, pdf_sources, tmp_path, metrics=metrics, sheet_name_scheme=sheet_name_scheme)
+        # ページ数が多く出力を分割した場合は、同じ名前のzipとして保存する
+        if result_type == 'zip':
+            output_path = os.path.splitext(output_path)[0] + '.zip'
+        os.replace(tmp_path, output_path)
+        record.update(status='done', file=os.path.basename(output_path))
+    except ConversionError as e:
+        record.update(status='error', message=e.message)
+    except Exception as e:
+        traceback.print_exc()
+        record.update(status='error', message=f"予期せぬエラーが発生しました: {e}")
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    record['pages'] = metrics.counters.get('pages', 0)
+    record['seconds'] = round(time.perf_counter() - started, 3)
+    return record
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ローカルのPDFをまとめてテンプレートのxlsmに変換する")
+    parser.add_argument('pdfs', nargs='+', help="PDFのディレクトリ・globパターン・ファイル")
+    parser.add_argument('--excel', required=True, help="テンプレートの1枚目のシートに貼り付けるExcelファイル")
+    parser.add_argument('--output-dir', required=True, help="xlsmの出力先ディレクトリ")
+    parser.add_argument('--template', default=TEMPLATE_FILE_PATH, help="テンプレートのxlsm")
+    parser.add_argument('--group-size', type=int, default=1,
+                        help="1つのxlsmにまとめるPDFの数（1: PDFごと（既定）、0: 全PDFを1ファイル）")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="並列に変換するプロセス数（1の場合はPDF_WORKERSでページ単位に並列化する）")
+    parser.add_argument('--sheet-names', default=None,
+                        help=f"ページのシート名の形式（既定: グループ化しない場合は{SHEET_NAME_SCHEME}、する場合は{{stem}}_P{{page}}）")
+    parser.add_argument('--recursive', action='store_true', help="ディレクトリを再帰的に探す")
+    parser.add_argument('--restart', action='store_true', help="チェックポイントを無視して最初から処理する")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.template):
+        parser.error(f"テンプレートファイル '{args.template}' が見つかりません。")
+    if not os.path.exists(args.excel):
+        parser.error(f"Excelファイル '{args.excel}' が見つかりません。")
+    pdf_paths = find_pdfs(args.pdfs, args.recursive)
+    if not pdf_paths:
+        parser.error("変換するPDFが見つかりません。")
+    sheet_name_scheme = args.sheet_names or (SHEET_NAME_SCHEME if args.group_size == 1 else '{stem}_P{page}')
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    checkpoint_path = os.path.join(args.output_dir, CHECKPOINT_FILE)
+    if args.restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    done = load_checkpoint(args.output_dir)
+    # 同じ出力名でも、まとめるPDFが前回と異なる場合は変換し直す
+    all_plans = plan_outputs(pdf_paths, args.group_size)
+    plans = [(name, paths) for name, paths in all_plans if done.get(name) != paths]
+    print(f"{len(pdf_paths)} PDFs -> {len(all_plans)} outputs"
+          f" ({len(all_plans) - len(plans)} already done, {len(plans)} to convert)", flush=True)
+
+    started = time.perf_counter()
+    results = []
+    with open(checkpoint_path, 'a', encoding='utf-8') as checkpoint:
+        def finish(record):
+            # 1件終わるごとにチェックポイントへ追記する（中断してもそこから再開できる）
+            checkpoint.write(json.dumps(record, ensure_ascii=False) + '\n')
+            checkpoint.flush()
+            results.append(record)
+            detail = f"{record['pages']} pages" if record['status'] == 'done' else record['message']
+            print(f"[{len(results)}/{len(plans)}] {record['status']:<5} {record.get('file', record['output'])}"
+                  f" ({len(record['pdfs'])} PDFs, {detail}, {record['seconds']:.1f}s)", flush=True)
+
+        outputs = [(paths, os.path.join(args.output_dir, name)) for name, paths in plans]
+        if args.workers <= 1:
+            converter.template_cache = TemplateCache(args.template)
+            for paths, output_path in outputs:
+                finish(convert_group(args.excel, paths, output_path, sheet_name_scheme))
+        else:
+            with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                                     initargs=(args.template,)) as executor:
+                futures = [executor.submit(convert_group, args.excel, paths, output_path, sheet_name_scheme)
+                           for paths, output_path in outputs]
+                for future in as_completed(futures):
+                    finish(future.result())
+    elapsed = time.perf_counter() - started
+
+    converted = [record for record in results if record['status'] == 'done']
+    files = sum(len(record['pdfs']) for record in converted)
+    pages = sum(record['pages'] for record in converted)
+    failed = len(results) - len(converted)
+    print(f"\nconverted {len(converted)} outputs ({files} PDFs, {pages} pages) in {elapsed:.1f}s"
+          f" - {files / elapsed if elapsed else 0:.2f} files/s, {pages / elapsed if elapsed else 0:.2f} pages/s"
+          + (f", {failed} failed" if failed else ''))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,50 @@
+"""
+header_parser.parse_page_header の出力が、最適化前の実装と同じであることを確認するチェック
+
+使い方:
+    python benchmarks/check_header_parser.py             # 全ケースを確認（不一致があれば終了コード1）
+    python benchmarks/check_header_parser.py --verbose   # 不一致のケースの入力と出力をすべて表示
+
+header_parser_cases.json は最適化前（逐次に正規表現を試す実装）の parse_page_header で作成した
+(title, name, role, remaining_text) の期待値を持つ
+手で用意した境界ケース（ID・氏名・日付に挟まれた名前・単独の名前・除外キーワード・空白のみの行など）と、
+出勤簿のヘッダー・表・注記の行を固定のシードで組み合わせたページからなる
+"""
+import argparse
+import json
+import os
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+CASES_FILE = os.path.join(BENCH_DIR, 'header_parser_cases.json')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="parse_page_headerの出力を期待値と比較する")
+    parser.add_argument('--cases', default=CASES_FILE, help="期待値のJSON")
+    parser.add_argument('--verbose', action='store_true', help="不一致のケースをすべて表示する")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, REPO_ROOT)
+    from header_parser import parse_page_header
+
+    with open(args.cases, encoding='utf-8') as f:
+        cases = json.load(f)
+
+    mismatches = []
+    for index, case in enumerate(cases):
+        actual = list(parse_page_header(case['text']))
+        if actual != case['expected']:
+            mismatches.append((index, case, actual))
+
+    for index, case, actual in mismatches if args.verbose else mismatches[:5]:
+        print(f"case {index}: {case['text']!r}")
+        print(f"  expected: {case['expected']!r}")
+        print(f"  actual:   {actual!r}")
+    print(f"{len(cases) - len(mismatches)}/{len(cases)} cases match")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
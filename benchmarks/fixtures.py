@@ -0,0 +1,172 @@
+"""
+ベンチマーク用の出勤簿PDFとアップロード用Excelをオフラインで生成するモジュール
+外部ライブラリを使わずにPDFを直接書き出す（日本語は埋め込みなしのCIDフォントで表現する）
+"""
+import os
+
+from openpyxl import Workbook
+
+PAGE_WIDTH = 595   # A4（ポイント）
+PAGE_HEIGHT = 842
+
+# 出勤簿の表の列
+TABLE_HEADER = ["日付", "曜日", "出勤", "退勤", "休憩", "勤務時間", "備考"]
+WEEKDAYS = ["月", "火", "水", "木", "金", "土", "日"]
+STAFF = [
+    ("2025030040", "日高 安澄", "正社員（一般）・園長（配置内）"),
+    ("2025030041", "山田 花子", "正社員（一般）・保育士（配置内）"),
+    ("2025030042", "佐藤 太郎", "パート・保育士（配置外）"),
+]
+
+
+def _hex_text(text):
+    # UniJIS-UCS2-Hエンコーディング用にUTF-16BEの16進文字列へ変換する
+    return '<' + text.encode('utf-16-be').hex().upper() + '>'
+
+
+def _text(x, y, text, size=10):
+    return f"BT /F1 {size} Tf {x} {y} Td {_hex_text(text)} Tj ET"
+
+
+def _page_content(page_index, days=31, with_table=True, footnote_lines=3):
+    """1ページ分のコンテンツストリームを作成する"""
+    staff_id, name, role = STAFF[page_index % len(STAFF)]
+    ops = [
+        _text(50, 800, "2025年4月出勤簿", size=14),
+        _text(50, 780, f"{staff_id} {name}"),
+        _text(50, 765, role),
+    ]
+
+    y = 740
+    if with_table:
+        row_height = 18
+        col_width = (PAGE_WIDTH - 100) / len(TABLE_HEADER)
+        rows = [TABLE_HEADER] + [
+            [f"{day}日", WEEKDAYS[day % 7], "8:30", "17:30", "1:00", "8:00", "" if day % 5 else "研修"]
+            for day in range(1, days + 1)
+        ]
+        top = y
+        bottom = top - row_height * len(rows)
+        ops.append("0.5 w")
+        # 罫線（横線・縦線）
+        for i in range(len(rows) + 1):
+            line_y = top - row_height * i
+            ops.append(f"50 {line_y} m {PAGE_WIDTH - 50} {line_y} l S")
+        for i in range(len(TABLE_HEADER) + 1):
+            line_x = 50 + col_width * i
+            ops.append(f"{line_x:.2f} {top} m {line_x:.2f} {bottom} l S")
+        for r, row in enumerate(rows):
+            for c, value in enumerate(row):
+                if value:
+                    ops.append(_text(f"{53 + col_width * c:.2f}", top - row_height * r - 13, value, size=9))
+        y = bottom - 20
+
+    for i in range(footnote_lines):
+        ops.append(_text(50, y - 14 * i, f"※{i + 1} 勤務時間は休憩時間を除いて記載しています。", size=8))
+    return '\n'.join(ops).encode('latin-1')
+
+
+def make_attendance_pdf(path, pages, tableless_every=0, footnote_lines=3):
+    """
+    出勤簿風のPDFを作成する
+    tableless_everyを指定すると、そのページ間隔で表のない（表紙・備考のみの）ページを混ぜる
+    """
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(None)
+    pages_obj = add(None)
+    descriptor = add(
+        b"<< /Type /FontDescriptor /FontName /HeiseiKakuGo-W5 /Flags 4 /FontBBox [-92 -250 1010 922]"
+        b" /ItalicAngle 0 /Ascent 752 /Descent -221 /CapHeight 737 /StemV 114 >>")
+    cid_font = add(
+        b"<< /Type /Font /Subtype /CIDFontType0 /BaseFont /HeiseiKakuGo-W5"
+        b" /CIDSystemInfo << /Registry (Adobe) /Ordering (Japan1) /Supplement 2 >>"
+        b" /FontDescriptor %d 0 R /DW 1000 /W [1 95 500] >>" % descriptor)
+    font = add(
+        b"<< /Type /Font /Subtype /Type0 /BaseFont /HeiseiKakuGo-W5-UniJIS-UCS2-H"
+        b" /Encoding /UniJIS-UCS2-H /DescendantFonts [%d 0 R] >>" % cid_font)
+
+    page_ids = []
+    for i in range(pages):
+        with_table = not (tableless_every and i % tableless_every == tableless_every - 1)
+        content = _page_content(i, with_table=with_table, footnote_lines=footnote_lines)
+        stream = add(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] /Contents %d 0 R"
+            b" /Resources << /Font << /F1 %d 0 R >> >> >>"
+            % (pages_obj, PAGE_WIDTH, PAGE_HEIGHT, stream, font)))
+
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_obj
+    objects[pages_obj - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % page_id for page_id in page_ids), len(page_ids))
+
+    with open(path, 'wb') as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            f.write(b"%010d 00000 n \n" % offset)
+        f.write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+                % (len(objects) + 1, catalog, xref))
+    return path
+
+
+def make_upload_excel(path, rows, columns=20, stray_format_row=None):
+    """
+    アップロード用のExcelを作成する
+    stray_format_rowを指定すると、その行に値のない書式だけのセルを置き、使用範囲を広げる
+    """
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.title = "シフト"
+    for r in range(1, rows + 1):
+        sheet.append([f"職員{r}" if c == 1 else (r * c) % 97 for c in range(1, columns + 1)])
+    if stray_format_row:
+        sheet.cell(row=stray_format_row, column=columns).number_format = '0.00'
+    workbook.save(path)
+    return path
+
+
+# Excelの最終行（書式だけのセルをここに置くと、シートの使用範囲が最大まで広がる）
+EXCEL_MAX_ROW = 1048576
+
+
+def ensure_fixtures(directory, pdf_sizes, excel_sizes):
+    """
+    ベンチマークに使用するフィクスチャを作成し、そのパスを返す（既にあるものは再利用する）
+    戻り値: ({ページ数: PDFのパス}, {行数: Excelのパス})
+    """
+    os.makedirs(directory, exist_ok=True)
+    pdfs = {}
+    for pages in pdf_sizes:
+        path = os.path.join(directory, f"attendance_{pages}p.pdf")
+        if not os.path.exists(path):
+            make_attendance_pdf(path, pages, tableless_every=10)
+        pdfs[pages] = path
+    excels = {}
+    for rows in excel_sizes:
+        path = os.path.join(directory, f"upload_{rows}rows.xlsx")
+        if not os.path.exists(path):
+            make_upload_excel(path, rows)
+        excels[rows] = path
+    return pdfs, excels
+
+
+def ensure_stray_format_excel(directory, rows):
+    """
+    最終行（1,048,576行目）に書式だけのセルがあるアップロード用Excelを作成し、そのパスを返す
+    使用範囲（dimension）が最終行まで広がるため、範囲全体を走査するコピー処理はここで極端に遅くなる
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"upload_{rows}rows_stray_format.xlsx")
+    if not os.path.exists(path):
+        make_upload_excel(path, rows, stray_format_row=EXCEL_MAX_ROW)
+    return path
@@ -0,0 +1,345 @@
+"""
+gunicornで起動したアプリに、複数のクライアントから同時にアップロードして負荷をかける負荷試験
+
+使い方:
+    python benchmarks/load_test.py --start                                  # gunicorn.conf.pyの設定で起動して計測
+    python benchmarks/load_test.py --start --workers 1 --threads 8 --job-workers 4   # スレッドで並列化する構成
+    python benchmarks/load_test.py --start --workers 4 --job-workers 1               # プロセスで並列化する構成
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --pid <gunicornのマスターのPID>
+
+各クライアントはフィクスチャの組み合わせ（--mix）からPDFを選んで /upload_and_process に送信し、
+ジョブの完了を待って結果をダウンロードするまでを1件として繰り返す
+スループット・レイテンシのパーセンタイルと、gunicornのワーカーごとのピークRSS（PDF抽出の子プロセスを含む）を表示する
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+# --- HTTP ---
+
+def _multipart(fields):
+    """[(フィールド名, ファイル名, バイト列)] からmultipart/form-dataの本文とContent-Typeを作る"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, filename, data in fields:
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'.encode('utf-8'))
+        parts.append(data)
+        parts.append(b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode('utf-8'))
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def _request(url, data=None, headers=None, timeout=60):
+    request = urllib.request.Request(url, data=data, headers=headers or {})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.read()
+
+
+def run_upload(base_url, excel, pdf, poll_interval, job_timeout):
+    """
+    1件のアップロードから結果のダウンロードまでを実行する
+    戻り値: 記録（アップロードの応答時間・完了までの時間・ページ数など）
+    """
+    body, content_type = _multipart([('excel_file', 'upload.xlsx', excel['data']),
+                                     ('pdf_files', pdf['name'], pdf['data'])])
+    started = time.perf_counter()
+    job = json.loads(_request(f"{base_url}/upload_and_process", body, {'Content-Type': content_type}))
+    accepted = time.perf_counter()
+
+    deadline = accepted + job_timeout
+    while True:
+        state = json.loads(_request(base_url + job['status_url']))
+        if state['status'] in ('done', 'error'):
+            break
+        if time.perf_counter() > deadline:
+            raise TimeoutError(f"job {job['job_id']} did not finish in {job_timeout}s")
+        time.sleep(poll_interval)
+    if state['status'] != 'done':
+        raise RuntimeError(state['message'])
+    finished = time.perf_counter()
+
+    result = _request(base_url + job['download_url'])
+    downloaded = time.perf_counter()
+    return {
+        'fixture': pdf['key'],
+        'pages': state['pages_total'],
+        'accept_seconds': accepted - started,
+        'job_seconds': finished - accepted,
+        'total_seconds': downloaded - started,
+        'bytes_out': len(result),
+    }
+
+
+# --- ワーカーのメモリ ---
+
+def _process_table():
+    """実行中の全プロセスの {pid: (親のpid, RSSのバイト数)} を返す（Linuxの/procを読む）"""
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    table = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # プロセス名に空白や括弧が含まれる場合があるため、最後の ')' 以降を分割する
+                fields = f.read().rsplit(')', 1)[1].split()
+            table[int(entry)] = (int(fields[1]), int(fields[21]) * page_size)
+        except (OSError, IndexError, ValueError):
+            continue  # 読み取り中に終了したプロセス
+    return table
+
+
+class WorkerMemorySampler(threading.Thread):
+    """
+    gunicornのマスタープロセスの子（ワーカー）ごとに、子孫プロセスを含むRSSを定期的に測ってピークを記録するスレッド
+    max_requestsで入れ替わったワーカーも、終了前までのピークを残す
+    """
+
+    def __init__(self, master_pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.master_pid = master_pid
+        self.interval = interval
+        self.peaks = {}    # ワーカーのpid -> ピークRSS
+        self.alive = set()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            self.sample()
+            self._stopped.wait(self.interval)
+
+    def sample(self):
+        table = _process_table()
+        children = {}
+        for pid, (ppid, _) in table.items():
+            children.setdefault(ppid, []).append(pid)
+
+        def tree_rss(pid):
+            return table[pid][1] + sum(tree_rss(child) for child in children.get(pid, ()))
+
+        self.alive = set(children.get(self.master_pid, ()))
+        for pid in self.alive:
+            self.peaks[pid] = max(self.peaks.get(pid, 0), tree_rss(pid))
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        self.sample()
+
+
+# --- gunicornの起動 ---
+
+def start_server(args, port):
+    """gunicornをgunicorn.conf.pyの設定で起動し、応答するまで待ってからPopenを返す"""
+    env = dict(os.environ)
+    env.update({
+        'GUNICORN_BIND': f"127.0.0.1:{port}",
+        'GUNICORN_ACCESSLOG': os.devnull,
+        'JOB_DIR': tempfile.mkdtemp(prefix='loadtest_jobs_'),
+    })
+    overrides = {
+        'GUNICORN_WORKERS': args.workers,
+        'GUNICORN_THREADS': args.threads,
+        'GUNICORN_MAX_REQUESTS': args.max_requests,
+        'JOB_WORKERS': args.job_workers,
+        'PDF_WORKERS': args.pdf_workers,
+    }
+    env.update({key: str(value) for key, value in overrides.items() if value is not None})
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'app:app'], cwd=REPO_ROOT, env=env)
+
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {server.returncode}")
+        try:
+            _request(f"http://127.0.0.1:{port}/", timeout=5)
+            return server
+        except (OSError, urllib.error.URLError):
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("gunicorn did not start within 60s")
+
+
+# --- 集計 ---
+
+def percentile(values, p):
+    """最近傍順位法によるパーセンタイル"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, -(-len(ordered) * p // 100) - 1))
+    return ordered[index]
+
+
+def summarize(records, errors, elapsed, sampler):
+    summary = {
+        'completed': len(records),
+        'errors': len(errors),
+        'elapsed_seconds': round(elapsed, 2),
+        'jobs_per_sec': round(len(records) / elapsed, 3) if elapsed else None,
+        'pages_per_sec': round(sum(r['pages'] for r in records) / elapsed, 2) if elapsed else None,
+        'latency': {},
+    }
+    groups = {'all': records}
+    for record in records:
+        groups.setdefault(record['fixture'], []).append(record)
+    for group, items in groups.items():
+        if not items:
+            continue
+        summary['latency'][group] = {
+            'count': len(items),
+            'accept_p50': round(percentile([r['accept_seconds'] for r in items], 50), 3),
+            **{f"p{p}": round(percentile([r['total_seconds'] for r in items], p), 3) for p in PERCENTILES},
+            'max': round(max(r['total_seconds'] for r in items), 3),
+        }
+    if sampler is not None:
+        summary['workers'] = {
+            str(pid): {'peak_rss_mb': round(rss / 1024 / 1024, 1), 'recycled': pid not in sampler.alive}
+            for pid, rss in sorted(sampler.peaks.items())
+        }
+    if errors:
+        summary['error_samples'] = sorted(set(errors))[:5]
+    return summary
+
+
+def print_summary(summary):
+    print(f"\ncompleted {summary['completed']} jobs ({summary['errors']} errors) in {summary['elapsed_seconds']:.1f}s"
+          f" - {summary['jobs_per_sec']:.3f} jobs/s, {summary['pages_per_sec']:.2f} pages/s")
+    print(f"\n{'fixture':<12}{'count':>7}{'accept':>9}" + ''.join(f"{'p' + str(p):>9}" for p in PERCENTILES)
+          + f"{'max':>9}   (seconds, upload to download)")
+    for group, stats in summary['latency'].items():
+        print(f"{group:<12}{stats['count']:>7}{stats['accept_p50']:>9.3f}"
+              + ''.join(f"{stats['p' + str(p)]:>9.3f}" for p in PERCENTILES) + f"{stats['max']:>9.3f}")
+    if 'workers' in summary:
+        print(f"\n{'worker pid':<12}{'peak rss':>12}")
+        for pid, stats in summary['workers'].items():
+            print(f"{pid:<12}{stats['peak_rss_mb']:>10.1f}MB" + ('  (recycled)' if stats['recycled'] else ''))
+    for message in summary.get('error_samples', []):
+        print(f"error: {message}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="gunicornで起動したアプリの負荷試験")
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help="試験対象のURL（--startを指定しない場合）")
+    parser.add_argument('--pid', type=int, help="gunicornのマスタープロセスのPID（ワーカーごとのメモリを測る場合）")
+    parser.add_argument('--start', action='store_true', help="gunicornを起動して試験し、終了後に停止する")
+    parser.add_argument('--port', type=int, default=8765, help="--startで起動する際のポート")
+    parser.add_argument('--workers', type=int, help="--start: GUNICORN_WORKERSを上書きする")
+    parser.add_argument('--threads', type=int, help="--start: GUNICORN_THREADSを上書きする")
+    parser.add_argument('--job-workers', type=int, help="--start: JOB_WORKERSを上書きする")
+    parser.add_argument('--pdf-workers', type=int, help="--start: PDF_WORKERSを上書きする")
+    parser.add_argument('--max-requests', type=int, help="--start: GUNICORN_MAX_REQUESTSを上書きする")
+    parser.add_argument('--concurrency', type=int, default=4, help="同時に送信するクライアント数")
+    parser.add_argument('--requests', type=int, default=20, help="送信するアップロードの総数")
+    parser.add_argument('--duration', type=float, help="指定した秒数が経つまで送信を続ける（--requestsより優先）")
+    parser.add_argument('--mix', default='1:4,10:4,100:1', help="PDFのページ数:重みのカンマ区切り")
+    parser.add_argument('--excel-rows', type=int, default=100, help="アップロードExcelの行数")
+    parser.add_argument('--fixtures-dir', default=os.path.join(tempfile.gettempdir(), 'pdfconvert_bench_fixtures'))
+    parser.add_argument('--poll-interval', type=float, default=0.2, help="ジョブの進捗を問い合わせる間隔（秒）")
+    parser.add_argument('--job-timeout', type=float, default=600, help="1件の変換を待つ最大秒数")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="結果のJSONの保存先")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, BENCH_DIR)
+    from fixtures import ensure_fixtures
+
+    mix = [(int(pages), float(weight)) for pages, weight in (item.split(':') for item in args.mix.split(',') if item)]
+    pdf_paths, excel_paths = ensure_fixtures(args.fixtures_dir, [pages for pages, _ in mix], [args.excel_rows])
+    fixtures = []
+    for pages, _ in mix:
+        with open(pdf_paths[pages], 'rb') as f:
+            fixtures.append({'key': f"{pages}p", 'name': os.path.basename(pdf_paths[pages]), 'data': f.read()})
+    weights = [weight for _, weight in mix]
+    with open(excel_paths[args.excel_rows], 'rb') as f:
+        excel = {'data': f.read()}
+
+    server = None
+    base_url = args.url.rstrip('/')
+    master_pid = args.pid
+    if args.start:
+        server = start_server(args, args.port)
+        base_url = f"http://127.0.0.1:{args.port}"
+        master_pid = server.pid
+    sampler = WorkerMemorySampler(master_pid) if master_pid else None
+
+    records = []
+    errors = []
+    lock = threading.Lock()
+    issued = [0]
+
+    def take():
+        # 次の1件を送信してよいかどうか（件数または時間の上限に達したらFalse）
+        with lock:
+            if args.duration is not None:
+                return time.perf_counter() - started < args.duration
+            if issued[0] >= args.requests:
+                return False
+            issued[0] += 1
+            return True
+
+    def client(index):
+        rng = random.Random(args.seed + index)
+        while take():
+            pdf = rng.choices(fixtures, weights)[0]
+            try:
+                record = run_upload(base_url, excel, pdf, args.poll_interval, args.job_timeout)
+            except Exception as e:
+                with lock:
+                    errors.append(f"{type(e).__name__}: {e}")
+                continue
+            with lock:
+                records.append(record)
+
+    try:
+        if sampler is not None:
+            sampler.start()
+        started = time.perf_counter()
+        clients = [threading.Thread(target=client, args=(i,)) for i in range(args.concurrency)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        if sampler is not None:
+            sampler.stop()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=120)
+
+    summary = summarize(records, errors, elapsed, sampler)
+    summary.update({
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'cpu_count': os.cpu_count(),
+        'concurrency': args.concurrency,
+        'mix': args.mix,
+        'server': {key: getattr(args, key) for key in ('workers', 'threads', 'job_workers', 'pdf_workers', 'max_requests')}
+                  if args.start else base_url,
+    })
+    print_summary(summary)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"saved: {args.output}")
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,274 @@
+"""
+変換処理の各段階とFlaskのエンドポイント全体を計測するベンチマーク
+
+使い方:
+    python benchmarks/run_benchmarks.py                       # 既定のサイズで計測
+    python benchmarks/run_benchmarks.py --sizes 1,10,100,500  # ページ数を指定
+    python benchmarks/run_benchmarks.py --save-baseline       # 結果をbaseline.jsonとして保存
+    python benchmarks/run_benchmarks.py --compare benchmarks/baseline.json
+
+各ケースは新しいプロセスで実行し、そのプロセスのピークRSSを段階ごとのメモリ使用量として記録する
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+
+STAGES = ('template', 'excel_copy', 'extract', 'header_parse', 'sheet_write', 'endpoint')
+# 段階ごとの入力の種類（PDFのページ数またはExcelの行数）
+STAGE_INPUT = {
+    'template': None,
+    'excel_copy': 'excel',
+    'extract': 'pdf',
+    'header_parse': 'pdf',
+    'sheet_write': 'pdf',
+    'endpoint': 'pdf',
+}
+
+
+def _setup_child():
+    os.chdir(REPO_ROOT)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+
+
+def _max_rss_mb(who=resource.RUSAGE_SELF):
+    # Linuxのru_maxrssはKB単位
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+# --- 各段階の計測（子プロセスで実行） ---
+# _prepare_<stage>(args) は計測対象外の準備を行い、計測する関数を返す
+# 計測する関数は (ページ数, 追加の記録項目) を返す
+
+def _prepare_template(args):
+    from converter import template_cache
+    template_cache.get()  # 初回の解析は計測対象外
+
+    def run():
+        for _ in range(args['iterations']):
+            template_cache.get()
+        return 0, {'iterations': args['iterations']}
+    return run
+
+
+def _prepare_excel_copy(args):
+    from openpyxl import load_workbook
+    from converter import copy_worksheet_data, template_cache
+    excel_bytes = _read(args['excel'])
+    template_workbook, start_row = template_cache.get()
+
+    def run():
+        uploaded = load_workbook(io.BytesIO(excel_bytes), read_only=True)
+        copied, _, _ = copy_worksheet_data(uploaded.worksheets[0], template_workbook.worksheets[0], start_row, 1)
+        uploaded.close()
+        return 0, {'bytes_in': len(excel_bytes), 'cells_copied': copied}
+    return run
+
+
+def _extract(pdf_bytes, filename):
+    from pdf_extractor import iter_pdf_pages
+    # キャッシュを経由せずに抽出する
+    return [page_data for _, page_data in iter_pdf_pages([(pdf_bytes, filename)], use_cache=False)]
+
+
+def _prepare_extract(args):
+    import pdf_extractor  # noqa: F401  (import時間は計測対象外)
+    pdf_bytes = _read(args['pdf'])
+
+    def run():
+        pages = _extract(pdf_bytes, os.path.basename(args['pdf']))
+        return len(pages), {'bytes_in': len(pdf_bytes)}
+    return run
+
+
+def _prepare_header_parse(args):
+    import pdfplumber
+    from header_parser import parse_page_header
+    with pdfplumber.open(args['pdf']) as pdf:
+        texts = [page.extract_text() or '' for page in pdf.pages]
+
+    def run():
+        for text in texts:
+            parse_page_header(text)
+        return len(texts), {}
+    return run
+
+
+def _prepare_sheet_write(args):
+    from converter import iter_page_cells, template_cache
+    from xlsm_writer import StreamingXlsmWriter
+    pages = _extract(_read(args['pdf']), os.path.basename(args['pdf']))
+    template_workbook, _ = template_cache.get()
+
+    def run():
+        with tempfile.TemporaryFile() as output:
+            with StreamingXlsmWriter(template_workbook, output) as writer:
+                for page_data in pages:
+                    writer.add_sheet(f"Page_{page_data['page_number']}", iter_page_cells(page_data))
+            return len(pages), {'bytes_out': output.tell()}
+    return run
+
+
+def _prepare_endpoint(args):
+    os.environ.setdefault('JOB_DIR', tempfile.mkdtemp(prefix='bench_jobs_'))
+    from app import app
+    client = app.test_client()
+    pdf_bytes = _read(args['pdf'])
+    excel_bytes = _read(args['excel'])
+
+    def run():
+        response = client.post('/upload_and_process', data={
+            'excel_file': (io.BytesIO(excel_bytes), 'upload.xlsx'),
+            'pdf_files': [(io.BytesIO(pdf_bytes), os.path.basename(args['pdf']))],
+        }, content_type='multipart/form-data')
+        job = response.get_json()
+        while True:
+            state = client.get(job['status_url']).get_json()
+            if state['status'] in ('done', 'error'):
+                break
+            time.sleep(0.02)
+        if state['status'] != 'done':
+            raise RuntimeError(state['message'])
+        download = client.get(job['download_url'])
+        return state['pages_total'], {'bytes_in': len(pdf_bytes) + len(excel_bytes),
+                                      'bytes_out': len(download.data)}
+    return run
+
+
+def _run_case(stage, args):
+    """子プロセスで1ケースを計測する"""
+    _setup_child()
+    os.environ.update(args.get('env', {}))
+    run = globals()[f'_prepare_{stage}'](args)
+    rss_before = _max_rss_mb()
+    start = time.perf_counter()
+    pages, extra = run()
+    seconds = time.perf_counter() - start
+    return {
+        'seconds': round(seconds, 4),
+        'pages': pages,
+        'pages_per_sec': round(pages / seconds, 2) if pages and seconds else None,
+        'peak_rss_mb': round(_max_rss_mb(), 1),
+        'rss_growth_mb': round(_max_rss_mb() - rss_before, 1),
+        'children_peak_rss_mb': round(_max_rss_mb(resource.RUSAGE_CHILDREN), 1),
+        **extra,
+    }
+
+
+def run_case(stage, args):
+    # 段階ごとのピークRSSを分けて測るため、毎回新しいプロセスで実行する
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1) as pool:
+        return pool.apply(_run_case, (stage, args))
+
+
+# --- 結果の比較 ---
+
+def compare(results, baseline, threshold):
+    """ベースラインと比較し、閾値を超えて遅く（または重く）なったケースの一覧を返す"""
+    regressions = []
+    print(f"\n{'case':<28}{'seconds':>12}{'baseline':>12}{'change':>10}{'rss':>10}{'base rss':>10}")
+    for key, result in results['cases'].items():
+        base = baseline.get('cases', {}).get(key)
+        if base is None:
+            print(f"{key:<28}{result['seconds']:>12.4f}{'-':>12}{'new':>10}")
+            continue
+        change = (result['seconds'] - base['seconds']) / base['seconds'] if base['seconds'] else 0.0
+        rss_change = (result['peak_rss_mb'] - base['peak_rss_mb']) / base['peak_rss_mb'] if base['peak_rss_mb'] else 0.0
+        flag = ''
+        if change > threshold or rss_change > threshold:
+            flag = '  <-- regression'
+            regressions.append(key)
+        print(f"{key:<28}{result['seconds']:>12.4f}{base['seconds']:>12.4f}{change:>+10.1%}"
+              f"{result['peak_rss_mb']:>10.1f}{base['peak_rss_mb']:>10.1f}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PDF→Excel変換のベンチマーク")
+    parser.add_argument('--sizes', default='1,10,100', help="PDFのページ数（カンマ区切り、最大500程度を想定）")
+    parser.add_argument('--excel-rows', default='100,5000', help="アップロードExcelの行数（カンマ区切り）")
+    parser.add_argument('--stages', default=','.join(STAGES), help="計測する段階（カンマ区切り）")
+    parser.add_argument('--fixtures-dir', default=os.path.join(tempfile.gettempdir(), 'pdfconvert_bench_fixtures'))
+    parser.add_argument('--template-iterations', type=int, default=20)
+    parser.add_argument('--pdf-workers', type=int, default=None, help="PDF_WORKERSを上書きする")
+    parser.add_argument('--output', help="結果のJSONの保存先")
+    parser.add_argument('--save-baseline', action='store_true', help=f"結果を{DEFAULT_BASELINE}に保存する")
+    parser.add_argument('--compare', metavar='BASELINE', help="ベースラインのJSONと比較する")
+    parser.add_argument('--threshold', type=float, default=0.10, help="回帰とみなす悪化率（既定10%%）")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, BENCH_DIR)
+    from fixtures import ensure_fixtures, ensure_stray_format_excel
+
+    pdf_sizes = [int(s) for s in args.sizes.split(',') if s]
+    excel_sizes = [int(s) for s in args.excel_rows.split(',') if s]
+    stages = [s for s in args.stages.split(',') if s]
+    for stage in stages:
+        if stage not in STAGES:
+            parser.error(f"unknown stage: {stage}")
+
+    pdfs, excels = ensure_fixtures(args.fixtures_dir, pdf_sizes, excel_sizes)
+    env = {'PDF_WORKERS': str(args.pdf_workers)} if args.pdf_workers is not None else {}
+    smallest_excel = excels[min(excel_sizes)]
+
+    results = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'cases': {},
+    }
+    for stage in stages:
+        if STAGE_INPUT[stage] == 'pdf':
+            cases = [(f"{stage}/{n}p", {'pdf': pdfs[n], 'excel': smallest_excel}) for n in pdf_sizes]
+        elif STAGE_INPUT[stage] == 'excel':
+            cases = [(f"{stage}/{n}rows", {'excel': excels[n]}) for n in excel_sizes]
+            # 最終行の書式だけのセルで使用範囲が1,048,576行まで広がったExcel（値のある行は最小のサイズと同じ）
+            stray_rows = min(excel_sizes)
+            cases.append((f"{stage}/{stray_rows}rows_stray_format",
+                          {'excel': ensure_stray_format_excel(args.fixtures_dir, stray_rows)}))
+        else:
+            cases = [(stage, {'iterations': args.template_iterations})]
+        for key, case_args in cases:
+            case_args['env'] = env
+            result = run_case(stage, case_args)
+            results['cases'][key] = result
+            rate = f"{result['pages_per_sec']:>9.1f} pages/s" if result['pages_per_sec'] else ' ' * 17
+            print(f"{key:<28}{result['seconds']:>10.4f}s {rate} peak {result['peak_rss_mb']:>8.1f}MB"
+                  f" (+{result['rss_growth_mb']:.1f}MB)", flush=True)
+
+    for path in filter(None, [args.output, DEFAULT_BASELINE if args.save_baseline else None]):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"saved: {path}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,242 @@
+import io
+import os
+
+from openpyxl import load_workbook
+
+from metrics import ConversionMetrics
+from pdf_extractor import iter_pdf_pages, source_size
+from sheet_names import SHEET_NAME_SCHEME, SheetNameAllocator
+from template_cache import TemplateCache
+from xlsm_writer import ShardedXlsmWriter, StreamingXlsmWriter
+
+# --- 定数設定 ---
+TEMPLATE_FILE_PATH = 'template.xlsm'  # テンプレートファイルのパス
+EXCEL_CELL_MAX_CHARS = 32767  # Excelの1セルあたりの文字数上限
+
+# --- 出力の分割の設定 ---
+# 1ファイルあたりのページ数・セル数の上限（0は上限なし）
+# どちらかを超える場合はテンプレートのコピーを複数作ってページを振り分け、まとめてzipで返す
+OUTPUT_SHARD_MAX_PAGES = int(os.environ.get('OUTPUT_SHARD_MAX_PAGES', 0))
+OUTPUT_SHARD_MAX_CELLS = int(os.environ.get('OUTPUT_SHARD_MAX_CELLS', 0))
+# アップロードされたExcelを貼り付けた1枚目のシートの扱い
+# 'every': 分割した全ファイルに含める、'master': master.xlsm にだけ含め、他のファイルは元のテンプレートから作る
+OUTPUT_SHARD_FIRST_SHEET = os.environ.get('OUTPUT_SHARD_FIRST_SHEET', 'every')
+
+# テンプレートは起動時に一度だけ解析し、更新された場合のみ読み込み直す
+template_cache = TemplateCache(TEMPLATE_FILE_PATH)
+
+_END = object()
+
+
+class ConversionError(Exception):
+    """
+    入力ファイルの内容が原因で変換できない場合の例外
+    messageは利用者にそのまま表示する
+    """
+
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+class NullProgress:
+    """進捗を報告しない場合に使用する何もしない進捗オブジェクト"""
+
+    def set_stage(self, stage, total=None):
+        pass
+
+    def add_total(self, pages):
+        pass
+
+    def advance(self, pages=1):
+        pass
+
+
+def copy_worksheet_data(source_sheet, target_sheet, start_row, start_col):
+    """
+    ソースシートからターゲットシートにデータをコピーする関数
+    既存のデータがある場合は指定した位置から貼り付ける
+    source_sheetはread_onlyモードで開いたシートを想定し、値のあるセルだけを行単位で読み込んで書き込む
+    戻り値: (コピーしたセル数, 実際にデータのある範囲の最終行, 最終列)
+    """
+    # 書式だけのセルで広がったdimension（例: A1:T1048576）は使わず、実際の行・セルだけを読む
+    # （dimensionを使うと末尾の空行や空セルまで補完して返されるため）
+    source_sheet.reset_dimensions()
+
+    copied = 0
+    last_row = 0
+    last_col = 0
+    # データをコピー（値のみ、書式は保持しない）
+    for row_idx, values in enumerate(source_sheet.iter_rows(values_only=True), start=1):
+        if not values:  # セルのない行
+            continue
+        for col_idx, value in enumerate(values, start=1):
+            if value is not None:  # 値がある場合のみコピー
+                target_sheet.cell(
+                    row=start_row + row_idx - 1,
+                    column=start_col + col_idx - 1
+                ).value = value
+                copied += 1
+                last_row = row_idx
+                last_col = max(last_col, col_idx)
+
+    return copied, last_row, last_col
+
+
+def iter_page_cells(page_data):
+    """
+    抽出したPDF1ページ分のデータをシート上のどのセルに配置するかを返すジェネレーター
+    (row, column, value) を行順（同じ行の中では列順）に返す
+    """
+    # --- 抽出した情報をExcelシートの特定セルに配置 ---
+    # A1セルにタイトル
+    yield 1, 1, page_data['title']
+    # A2セルに名前
+    yield 2, 1, page_data['name']
+    # C2セルに役割
+    yield 2, 3, page_data['role']
+
+    # 以降のコンテンツ（表や残りのテキスト）の開始行を調整
+    # A1, A2, C2のために2行使用したので、3行目以降から開始
+    current_row = 4 # 3行目まで使用済みの場合は4行目から開始
+
+    # 表データがある場合は表として配置
+    if page_data['tables']:
+        # 表の前に少しスペースを開ける
+        current_row += 1
+        for table_info in page_data['tables']:
+            table_data = table_info['data']
+            table_idx = table_info['table_index']
+
+            # 表のタイトルを追加（複数の表がある場合）
+            if len(page_data['tables']) > 1:
+                yield current_row, 1, f"表 {table_idx + 1}"
+                current_row += 1
+
+            # 表のデータをExcelセルに配置
+            for row_idx, row_data in enumerate(table_data):
+                for col_idx, cell_data in enumerate(row_data):
+                    if cell_data:  # 空でないセルのみ配置
+                        # セルの文字数制限を考慮
+                        yield current_row + row_idx, col_idx + 1, str(cell_data)[:EXCEL_CELL_MAX_CHARS]
+
+            # 表の後に空行を追加
+            current_row += len(table_data) + 2
+
+    # 表以外のテキストがある場合は追加情報として配置
+    # 抽出済みのテキスト（タイトル・名前・役割）はここには含まれないように調整済み
+    if page_data['text'] and page_data['text'].strip():
+        # 「その他のテキスト」というヘッダーは、実際に残りのテキストがある場合にのみ表示
+        yield current_row, 1, "その他のテキスト:"
+        current_row += 1
+
+        # テキストを行ごとに分割して配置
+        for line in page_data['text'].split('\n'):
+            if line.strip():  # 空行はスキップ
+                # セルの文字数制限を考慮
+                yield current_row, 1, line[:EXCEL_CELL_MAX_CHARS].strip()
+                current_row += 1
+
+
+def _timed(iterable, metrics, stage):
+    """iterableから次の要素を受け取るまでの待ち時間をmetricsのstageに加算しながら要素を返す"""
+    iterator = iter(iterable)
+    while True:
+        with metrics.stage(stage):
+            item = next(iterator, _END)
+        if item is _END:
+            return
+        yield item
+
+
+def convert(excel_bytes, pdf_sources, output, progress=None, metrics=None, sheet_name_scheme=SHEET_NAME_SCHEME,
+            shard_max_pages=OUTPUT_SHARD_MAX_PAGES, shard_max_cells=OUTPUT_SHARD_MAX_CELLS,
+            shard_first_sheet=OUTPUT_SHARD_FIRST_SHEET):
+    """
+    アップロードされたExcelとPDFからテンプレートを埋めたxlsmを作成する関数
+    excel_bytesにはExcelのバイト列またはファイルのパスを指定できる
+    pdf_sourcesは (PDFのバイト列またはファイルのパス, filename) のリスト
+    outputは保存先のファイルパスまたはファイルオブジェクト
+    progressには段階と処理済みページ数が報告される
+    metrics(ConversionMetrics)には段階ごとの所要時間と件数・バイト数が記録される
+    sheet_name_schemeはページのシート名の形式（sheet_names.SHEET_NAME_SCHEMEを参照）
+    shard_max_pages・shard_max_cells・shard_first_sheetは出力の分割の設定（OUTPUT_SHARD_*を参照）
+    戻り値: outputに保存した形式（'xlsm'、または分割した場合は複数のxlsmをまとめた'zip'）
+    """
+    progress = progress or NullProgress()
+    metrics = metrics or ConversionMetrics()
+    metrics.count('bytes_in', source_size(excel_bytes) + sum(source_size(source) for source, _ in pdf_sources))
+
+    # キャッシュ済みテンプレートのコピーを取得（元のファイルは変更されない）
+    with metrics.stage('template_load'):
+        template_workbook, start_row = template_cache.get()
+
+    with metrics.stage('excel_copy'):
+        # 1. アップロードされたExcelファイルの読み込み（値を順に読むだけなのでread_onlyモードで開く）
+        # パスの場合もファイルオブジェクトとして渡す（openpyxlに拡張子で形式を判定させない）
+        excel_source = io.BytesIO(excel_bytes) if isinstance(excel_bytes, (bytes, bytearray)) else open(excel_bytes, 'rb')
+        with excel_source:
+            uploaded_excel_workbook = load_workbook(excel_source, read_only=True)
+            try:
+                # アップロードされたExcelの1ページ目を取得
+                if len(uploaded_excel_workbook.worksheets) == 0:
+                    raise ConversionError("アップロードされたExcelファイルにシートがありません。")
+
+                uploaded_first_sheet = uploaded_excel_workbook.worksheets[0]
+
+                # 2. テンプレートの1枚目のシートにアップロードされたデータを貼り付け
+                if len(template_workbook.worksheets) == 0:
+                    raise ConversionError("テンプレートファイルにシートがありません。")
+
+                template_first_sheet = template_workbook.worksheets[0]
+
+                # 貼り付け開始位置はテンプレート読み込み時に計算済み
+                copied, _, _ = copy_worksheet_data(uploaded_first_sheet, template_first_sheet, start_row, 1)
+                metrics.count('cells_copied', copied)
+            finally:
+                uploaded_excel_workbook.close()
+
+    # 3. テンプレート部分を先に保存し、各ページのシートは1枚ずつoutputへ直接書き込む（VBAマクロも保持）
+    # シート名は分割したファイルをまたいでも重複しないように割り当てる
+    sheet_names = SheetNameAllocator([ws.title for ws in template_workbook.worksheets], sheet_name_scheme)
+    with metrics.stage('template_save'):
+        if shard_max_pages or shard_max_cells:
+            if shard_first_sheet == 'master':
+                shard_template, _ = template_cache.get()
+                writer = ShardedXlsmWriter(shard_template, output, shard_max_pages, shard_max_cells,
+                                           master_workbook=template_workbook)
+            else:
+                writer = ShardedXlsmWriter(template_workbook, output, shard_max_pages, shard_max_cells)
+        else:
+            writer = StreamingXlsmWriter(template_workbook, output)
+    with writer:
+        # 4. PDFファイルの処理（表構造を保持する高度な処理）
+        # 全PDFのページをプロセスプールで並列に抽出し、PDF順・ページ順に1ページずつ受け取ってシートに書き出す
+        # 抽出済みのページはシートに書き込んだ時点で破棄され、PDF全体を保持することはない
+        progress.set_stage('converting', total=0)
+        page_counts = [0] * len(pdf_sources)
+        pages = iter_pdf_pages(pdf_sources, progress=progress, metrics=metrics)
+        try:
+            for source_index, page_data in _timed(pages, metrics, 'pdf_extract'):
+                # シート名を「Page_1」「Page_2」などの形式で生成（同名のシートがある場合は番号を付ける）
+                sheet_name = sheet_names.allocate(page_data['page_number'], pdf_sources[source_index][1])
+
+                with metrics.stage('sheet_write'):
+                    metrics.count('cells_written', writer.add_sheet(sheet_name, iter_page_cells(page_data)))
+                page_counts[source_index] += 1
+                progress.advance()
+        finally:
+            # 書き込みに失敗した場合も一時ファイルの削除と未実行タスクの取り消しをすぐに行う
+            pages.close()
+
+        for (_, filename), page_count in zip(pdf_sources, page_counts):
+            if not page_count:
+                raise ConversionError(f"PDF '{filename}' から有効な内容を抽出できませんでした。")
+        metrics.count('pages', sum(page_counts))
+
+        progress.set_stage('saving')
+        with metrics.stage('save'):
+            writer.close()
+
+    metrics.count('bytes_out', os.path.getsize(output) if isinstance(output, str) else output.tell())
+    return 'zip' if writer.is_zip else 'xlsm'
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+# --- キャッシュの設定 ---
+# メモリ上に保持する最大件数・最大バイト数
+PDF_CACHE_MAX_ENTRIES = int(os.environ.get('PDF_CACHE_MAX_ENTRIES', 256))
+PDF_CACHE_MAX_BYTES = int(os.environ.get('PDF_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+# gunicornの複数ワーカーで共有する場合のディレクトリ（未設定の場合はメモリのみ）
+PDF_CACHE_DIR = os.environ.get('PDF_CACHE_DIR') or None
+PDF_CACHE_DIR_MAX_BYTES = int(os.environ.get('PDF_CACHE_DIR_MAX_BYTES', 512 * 1024 * 1024))
+
+
+class ExtractionCache:
+    """
+    PDF抽出結果（ページごとのpage_dataのリスト）のキャッシュ
+    キーはPDFの中身のSHA-256と抽出処理のバージョン
+    メモリ上はLRUで件数・バイト数の上限を超えたら古いものから破棄する
+    cache_dirを指定した場合はディスクにも保存し、複数プロセスで共有する
+    """
+
+    def __init__(self, max_entries=PDF_CACHE_MAX_ENTRIES, max_bytes=PDF_CACHE_MAX_BYTES,
+                 cache_dir=PDF_CACHE_DIR, dir_max_bytes=PDF_CACHE_DIR_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.dir_max_bytes = dir_max_bytes
+        self._entries = OrderedDict()  # key -> JSONにシリアライズしたpage_dataのリスト
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(pdf_bytes, version):
+        """PDFの中身と抽出処理のバージョンからキャッシュキーを生成する"""
+        return f"{hashlib.sha256(pdf_bytes).hexdigest()}-{version}"
+
+    def get(self, key):
+        """キャッシュされた抽出結果を返す（見つからない場合はNone）"""
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return json.loads(payload)
+
+        payload = self._read_disk(key)
+        with self._lock:
+            if payload is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._put_memory(key, payload)
+        return json.loads(payload)
+
+    def put_payload(self, key, payload):
+        """JSONにシリアライズ済みの抽出結果をキャッシュに保存する"""
+        with self._lock:
+            self._put_memory(key, payload)
+        self._write_disk(key, payload)
+
+    def stats(self):
+        """ヒット数・ミス数などの統計を返す"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'disk_hits': self.disk_hits,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._size,
+            }
+
+    # --- メモリ ---
+
+    def _put_memory(self, key, payload):
+        if len(payload) > self.max_bytes:
+            return  # 単体で上限を超えるものはメモリに載せない
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= len(old)
+        self._entries[key] = payload
+        self._size += len(payload)
+        while self._entries and (len(self._entries) > self.max_entries or self._size > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+            self.evictions += 1
+
+    # --- ディスク ---
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                payload = f.read()
+            os.utime(path)  # LRUのため最終利用日時を更新
+            return payload
+        except OSError:
+            return None
+
+    def _write_disk(self, key, payload):
+        if not self.cache_dir:
+            return
+        try:
+            # 他のワーカーが書きかけのファイルを読まないよう、一時ファイル経由で置き換える
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp_path, self._path(key))
+            self._prune_disk()
+        except OSError as e:
+            print(f"抽出キャッシュの書き込みに失敗しました: {e}")
+
+    def _prune_disk(self):
+        """ディスク上のキャッシュが上限を超えた場合、最終利用日時が古いものから削除する"""
+        files = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.json'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        if total <= self.dir_max_bytes:
+            return
+        for _, size, path in sorted(files):
+            if total <= self.dir_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
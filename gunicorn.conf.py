@@ -0,0 +1,65 @@
+"""
+本番環境でgunicornを起動する際の設定（gunicornはカレントディレクトリのこのファイルを自動で読み込む）
+
+    gunicorn app:app
+
+変換処理はCPUを使い続けるため、並列に処理する単位はスレッドではなくワーカープロセスとし、
+各ワーカーのスレッドはアップロードの受信と進捗の問い合わせにだけ使う
+設定値は環境変数で上書きできる（benchmarks/load_test.py で組み合わせを比較できる）
+
+制限: ジョブはアップロードを受け付けたワーカーのプロセス内のキューで実行され、ワーカー間で分け合うことはない
+そのため、他のワーカーが空いていても、受け付けたワーカーで実行中の変換が終わるまで待つことがある
+（同時に届いたアップロードがどのワーカーに割り振られるかはOS次第で、全コアが使われることは保証されない）
+"""
+import multiprocessing
+import os
+import sys
+
+# --- 待ち受け ---
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+
+# --- ワーカー ---
+# ワーカープロセス数（既定はCPUコア数。1プロセスが同時に実行する変換はJOB_WORKERS件）
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+# 各ワーカーでリクエストを処理するスレッド数（変換はジョブキューで実行するため、アップロードと進捗の問い合わせ用）
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# ワーカープロセスごとに変換を1件ずつ、PDF抽出もそのプロセス内で逐次に実行し、
+# CPUコア数を超えてプロセス・スレッドが競合しないようにする（環境変数で明示した場合はそちらを使う）
+# 上記の制限により、待ち時間の偏りが問題になる場合はJOB_WORKERSを増やす（CPUを取り合う代わりに待たされにくくなる）
+os.environ.setdefault('JOB_WORKERS', '1')
+os.environ.setdefault('PDF_WORKERS', '1')
+
+# --- ワーカーの再起動 ---
+# openpyxl・pdfminerの断片化などで増えたメモリを解放するため、一定数のリクエストを処理したワーカーを入れ替える
+# （進捗の問い合わせも1リクエストと数えるため、変換の件数より多めに設定する）
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+# 全ワーカーが同時に入れ替わらないようにずらす幅
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+# --- タイムアウト ---
+# 入れ替え対象になったワーカーは受け付け済みの変換ジョブを終えてから終了するが、
+# その間は応答が止まったとみなされるため、最も長い変換にかかる時間より長くする
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 600))
+# 停止・再起動の指示（SIGTERM）を受けてから、ワーカーを強制終了するまでの秒数
+# 終了するワーカーは受け付け済みの変換ジョブを終えるまで待つため、timeoutと同じ長さにする
+# （これより長い変換や、コンテナの停止猶予（docker stop -t など）がこれより短い場合はジョブが失われ、
+#   jobs.JOB_STALE_SECONDSが過ぎた時点でエラーとして利用者に返される）
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', timeout))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# --- ログ ---
+accesslog = os.environ.get('GUNICORN_ACCESSLOG', '-')
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOGLEVEL', 'info')
+
+
+def worker_exit(server, worker):
+    # 受け付け済みの変換ジョブを終えてから終了する（結果はJOB_DIRに保存され、他のワーカーから取得される）
+    # 待てる時間はtimeout（入れ替え時）・graceful_timeout（停止・再起動時）まで
+    # （アプリの読み込みに失敗したワーカーでは何もしない）
+    app = sys.modules.get('app')
+    if app is not None:
+        app.job_queue.shutdown(wait=True)
+        sys.modules['pdf_extractor'].shutdown_executor()
@@ -0,0 +1,116 @@
+import re
+
+# 役割として抽出するキーワード
+ROLE_KEYWORDS = ("正社員", "パート", "園長", "保育士")
+
+# 名前に使用できる文字（全角文字・空白・中黒・長音）
+_NAME_CHARS = r'[\u3000-\u9FFF\uFF00-\uFFEF\s・ー]'
+
+# --- 正規表現（モジュール読み込み時に一度だけコンパイル） ---
+# タイトル（例: "YYYY年M月出勤簿"）。年、月、出勤簿の間にスペースを許容する
+TITLE_PATTERN = re.compile(r'(\d{4}年\s*\d{1,2}月\s*出勤簿)')
+# 役割キーワード。単語の境界(\b)を使って全キーワードを1つの選択パターンでマッチさせる
+ROLE_PATTERN = re.compile(r'\b(?:' + '|'.join(re.escape(kw) for kw in ROLE_KEYWORDS) + r')\b')
+# 名前の優先度1: 10桁のID番号に続く名前（例: "2025030040 日高 安澄"）。後に日付情報が続く可能性を考慮
+ID_NAME_PATTERN = re.compile(r'^\s*\d{10}\s*(' + _NAME_CHARS + r'+?)(?:\s+\d{4}年|\s*$)')
+# 名前の優先度2: "氏名："に続く名前
+SHIMEI_PATTERN = re.compile(r'氏名[:：\s]*(' + _NAME_CHARS + r'{2,})')
+# 名前の優先度3: 日付に挟まれた名前
+NAME_BETWEEN_DATES_PATTERN = re.compile(
+    r'\d{4}年\d{1,2}月\d{1,2}日\s*(' + _NAME_CHARS + r'+?)\s*\d{4}年\d{1,2}月\d{1,2}日')
+# 名前の優先度4: 行全体が日本語名
+STANDALONE_NAME_PATTERN = re.compile(r'^(' + _NAME_CHARS + r'{2,})$')
+# 名前として扱わない文字列（日付や役割/タイトルキーワード）
+NAME_EXCLUSION_PATTERN = re.compile(r'\d{4}年|\d{1,2}月|\d{1,2}日|正社員|パート|園長|保育士|出勤簿')
+
+
+def _match_name(line, has_exclusion):
+    """
+    1行から名前を優先度順に探す（見つからない場合はNone）
+    has_exclusionは行全体に除外パターンが含まれるかどうか
+    行に含まれない場合はその一部である名前の候補にも含まれないため、候補ごとの確認を省略する
+    """
+    # 優先度1: 10桁のID番号に続く名前
+    match = ID_NAME_PATTERN.match(line)
+    if match:
+        potential_name = match.group(1).strip()
+        if not has_exclusion or not NAME_EXCLUSION_PATTERN.search(potential_name):
+            return potential_name
+
+    # 優先度2: "氏名："に続く名前
+    if '氏名' in line:
+        match = SHIMEI_PATTERN.search(line)
+        if match:
+            potential_name = match.group(1).strip()
+            if not has_exclusion or not NAME_EXCLUSION_PATTERN.search(potential_name):
+                return potential_name
+
+    # 優先度3: 日付に挟まれた名前（日付がなければ除外パターンにも一致しない）
+    if has_exclusion:
+        match = NAME_BETWEEN_DATES_PATTERN.search(line)
+        if match:
+            potential_name = match.group(1).strip()
+            if not NAME_EXCLUSION_PATTERN.search(potential_name):
+                return potential_name
+
+    # 優先度4: 単独の日本語名（行全体が日付パターンや役割/タイトルキーワードを含まないこと）
+    if not has_exclusion:
+        match = STANDALONE_NAME_PATTERN.match(line)
+        if match:
+            return match.group(1).strip()
+
+    return None
+
+
+def parse_page_header(text):
+    """
+    PDFページのテキストからタイトル・名前・役割を抽出する関数
+    戻り値: (title, name, role, remaining_text)
+    remaining_text は抽出に使用されなかった行のみを改行で結合したテキスト
+    各行は1回の走査で分類し、3項目とも見つかった後の行はそのまま残りのテキストに回す
+    """
+    extracted_title = ""
+    extracted_name = ""
+    extracted_role = ""
+    remaining_text_lines = []
+
+    if not text:
+        return extracted_title, extracted_name, extracted_role, ''
+
+    for line in text.split('\n'):
+        current_line = line.strip()
+        if not current_line: # 空行は「その他のテキスト」にも含めない
+            continue
+
+        if extracted_title and extracted_role and extracted_name:
+            remaining_text_lines.append(current_line)
+            continue
+
+        # 1. タイトル（例: "YYYY年M月出勤簿"）
+        if not extracted_title and '出勤簿' in current_line:
+            title_match = TITLE_PATTERN.search(current_line)
+            if title_match:
+                extracted_title = title_match.group(1).strip()
+                continue # タイトルが見つかったら、この行での他の抽出は行わない
+
+        # 2. 雇用と役割（例: "正社員（一般）・園長（配置内）"）
+        if not extracted_role:
+            found_roles_on_line = ROLE_PATTERN.findall(current_line)
+            if found_roles_on_line:
+                # 見つかった役割をソートし、ユニークなものだけを " / " で結合
+                extracted_role = " / ".join(sorted(set(found_roles_on_line)))
+                continue # 役割が見つかったら、この行での他の抽出は行わない
+
+        # 3. 名前
+        if not extracted_name:
+            has_exclusion = NAME_EXCLUSION_PATTERN.search(current_line) is not None
+            potential_name = _match_name(current_line, has_exclusion)
+            if potential_name is not None:
+                extracted_name = potential_name
+                continue
+
+        # 抽出に使用されなかった行
+        remaining_text_lines.append(current_line)
+
+    remaining_text = '\n'.join(remaining_text_lines)
+    return extracted_title, extracted_name, extracted_role, remaining_text
@@ -0,0 +1,201 @@
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from converter import ConversionError
+
+# --- ジョブキューの設定 ---
+# ジョブの状態と結果ファイルを置くディレクトリ（gunicornの全ワーカーから参照できる場所にする）
+JOB_DIR = os.environ.get('JOB_DIR') or os.path.join(tempfile.gettempdir(), 'pdfconvert_jobs')
+# 同時に実行するジョブ数（プロセスごと）
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+# 完了したジョブの結果を保持する秒数
+JOB_TTL_SECONDS = int(os.environ.get('JOB_TTL_SECONDS', 60 * 60))
+# 進捗をファイルに書き出す最小間隔（秒）
+PROGRESS_WRITE_INTERVAL = 0.5
+# 待機中・実行中のジョブの状態ファイルを書き直して、ワーカーが生きていることを示す間隔（秒）
+JOB_HEARTBEAT_INTERVAL = int(os.environ.get('JOB_HEARTBEAT_INTERVAL', 10))
+# 待機中・実行中のまま状態ファイルがこの秒数更新されていないジョブは、ワーカーが停止したとみなしてエラーにする
+JOB_STALE_SECONDS = int(os.environ.get('JOB_STALE_SECONDS', 120))
+
+_JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+def _result_file(job_dir, job_id):
+    # 結果はxlsmまたはzipのため、拡張子は付けずに保存する（形式はジョブの状態のresult_typeで判断する）
+    return os.path.join(job_dir, f"{job_id}.result")
+
+
+class Job:
+    """
+    1件の変換ジョブ
+    状態はJOB_DIR内のJSONファイルに書き出し、どのワーカーからでも参照できるようにする
+    converterの進捗オブジェクトとしても使用する
+    """
+
+    def __init__(self, job_id, job_dir, download_name):
+        self.job_id = job_id
+        self.job_dir = job_dir
+        self.state = {
+            'job_id': job_id,
+            'status': 'queued',   # queued / running / done / error
+            'stage': '',          # converting / saving
+            'pages_done': 0,
+            'pages_total': 0,
+            'message': '',
+            'download_name': download_name,
+            'result_type': 'xlsm',  # xlsm / zip（ページ数が多く出力を分割した場合）
+            'created_at': time.time(),
+            'updated_at': time.time(),
+        }
+        self._lock = threading.Lock()
+        self._last_write = 0.0
+
+    @property
+    def result_path(self):
+        return _result_file(self.job_dir, self.job_id)
+
+    def update(self, force=True, **fields):
+        with self._lock:
+            self.state.update(fields)
+            self.state['updated_at'] = time.time()
+            if force or self.state['updated_at'] - self._last_write >= PROGRESS_WRITE_INTERVAL:
+                self._write()
+
+    def _write(self):
+        # 書きかけのファイルを読まれないよう、一時ファイル経由で置き換える
+        path = os.path.join(self.job_dir, f"{self.job_id}.json")
+        fd, tmp_path = tempfile.mkstemp(dir=self.job_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self._last_write = self.state['updated_at']
+
+    # --- 進捗の報告（converter.NullProgressと同じインターフェース） ---
+
+    def set_stage(self, stage, total=None):
+        # totalを指定した場合は処理済みページ数を0に戻す
+        if total is None:
+            self.update(stage=stage)
+        else:
+            self.update(stage=stage, pages_done=0, pages_total=total)
+
+    def add_total(self, pages):
+        self.update(force=False, pages_total=self.state['pages_total'] + pages)
+
+    def advance(self, pages=1):
+        self.update(force=False, pages_done=self.state['pages_done'] + pages)
+
+
+class JobQueue:
+    """
+    変換ジョブをローカルのスレッドプールで実行するキュー
+    結果ファイルはJOB_DIRに保存し、JOB_TTL_SECONDSを過ぎたら削除する
+    待機中・実行中のジョブはJOB_HEARTBEAT_INTERVALごとに状態ファイルを書き直し、
+    ワーカーの強制終了などで更新が止まったジョブは、状態の問い合わせ時にエラーとして返す
+    """
+
+    def __init__(self, job_dir=JOB_DIR, workers=JOB_WORKERS, ttl_seconds=JOB_TTL_SECONDS,
+                 heartbeat_interval=JOB_HEARTBEAT_INTERVAL, stale_seconds=JOB_STALE_SECONDS):
+        self.job_dir = job_dir
+        self.ttl_seconds = ttl_seconds
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_seconds = stale_seconds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self._active = {}  # このプロセスで待機中・実行中のジョブ
+        self._lock = threading.Lock()
+        self._heartbeat_thread = None
+        os.makedirs(self.job_dir, exist_ok=True)
+
+    def submit(self, func, *args, download_name):
+        """
+        func(job, *args) をバックグラウンドで実行するジョブを登録し、ジョブIDを返す
+        funcはjob.result_pathに結果ファイルを書き出す
+        """
+        self.cleanup()
+        job = Job(uuid.uuid4().hex, self.job_dir, download_name)
+        job.update()
+        with self._lock:
+            self._active[job.job_id] = job
+            if self._heartbeat_thread is None:
+                # gunicornのワーカーでforkした後に起動するよう、最初のジョブの登録時に開始する
+                self._heartbeat_thread = threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True)
+                self._heartbeat_thread.start()
+        self._executor.submit(self._run, job, func, args)
+        return job.job_id
+
+    def _run(self, job, func, args):
+        job.update(status='running')
+        try:
+            func(job, *args)
+        except ConversionError as e:
+            job.update(status='error', message=e.message)
+        except Exception as e:
+            # エラーログ出力
+            print(f"An error occurred: {e}")
+            traceback.print_exc() # 詳細なトレースバックを出力
+            job.update(status='error', message=f"ファイル処理中に予期せぬエラーが発生しました: {e}")
+        else:
+            job.update(status='done')
+        finally:
+            with self._lock:
+                self._active.pop(job.job_id, None)
+
+    def _heartbeat(self):
+        # 待機中・実行中のジョブのupdated_atを定期的に書き直す（進捗が進まない間も生きていることを示す）
+        while True:
+            time.sleep(self.heartbeat_interval)
+            with self._lock:
+                jobs = list(self._active.values())
+            for job in jobs:
+                try:
+                    job.update()
+                except OSError:
+                    pass
+
+    def shutdown(self, wait=True):
+        """新しいジョブの受け付けを止める（waitがTrueの場合は受け付け済みのジョブが終わるまで待つ）"""
+        self._executor.shutdown(wait=wait)
+
+    def status(self, job_id):
+        """ジョブの状態を返す（存在しない場合はNone）"""
+        if not _JOB_ID_PATTERN.match(job_id):
+            return None
+        try:
+            with open(os.path.join(self.job_dir, f"{job_id}.json"), encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state['status'] in ('queued', 'running') and time.time() - state['updated_at'] > self.stale_seconds:
+            # 実行していたワーカーが強制終了された（タイムアウト・メモリ不足など）ため、完了することはない
+            state.update(status='error', message="変換を実行していたサーバーのプロセスが停止したため、処理を完了できませんでした。"
+                                                 "もう一度お試しください。")
+        return state
+
+    def result_path(self, job_id):
+        """完了したジョブの結果ファイルのパスを返す（未完了・存在しない場合はNone）"""
+        state = self.status(job_id)
+        if not state or state['status'] != 'done':
+            return None
+        path = _result_file(self.job_dir, job_id)
+        return path if os.path.exists(path) else None
+
+    def cleanup(self):
+        """保持期間を過ぎたジョブの状態・結果ファイルを削除する"""
+        expires_before = time.time() - self.ttl_seconds
+        try:
+            entries = list(os.scandir(self.job_dir))
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                if entry.stat().st_mtime < expires_before:
+                    os.remove(entry.path)
+            except OSError:
+                pass
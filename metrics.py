@@ -0,0 +1,198 @@
+import cProfile
+import json
+import os
+import resource
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# --- 計測の設定 ---
+# gunicornの複数ワーカーの値を集計する場合の共有ディレクトリ（未設定の場合はプロセス内の値のみ）
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+# cProfileの出力先
+PROFILE_DIR = os.environ.get('PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'pdfconvert_profiles')
+
+# 変換1件あたりの所要時間のヒストグラムの区切り（秒）
+DURATION_BUCKETS = (0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600)
+
+# 出力するメトリクスの (種類, 説明)
+METRIC_FAMILIES = {
+    'pdfconvert_conversions_total': ('counter', "変換ジョブの件数（status別）"),
+    'pdfconvert_conversion_duration_seconds': ('histogram', "変換ジョブ1件の所要時間"),
+    'pdfconvert_stage_duration_seconds': ('summary', "段階ごとの所要時間（PDF抽出の内訳はワーカーでの合計時間）"),
+    'pdfconvert_pages_total': ('counter', "処理したPDFのページ数"),
+    'pdfconvert_pages_table_total': ('counter', "表の検出を行ったページ数"),
+    'pdfconvert_pages_text_only_total': ('counter', "罫線がないため表の検出を省略したページ数"),
+    'pdfconvert_pages_fallback_total': ('counter', "PyPDF2でテキストのみ抽出したページ数"),
+    'pdfconvert_cells_copied_total': ('counter', "アップロードされたExcelからテンプレートへコピーしたセル数"),
+    'pdfconvert_cells_written_total': ('counter', "ページシートに書き込んだセル数"),
+    'pdfconvert_bytes_in_total': ('counter', "アップロードされたファイルのバイト数"),
+    'pdfconvert_bytes_out_total': ('counter', "作成したxlsmのバイト数"),
+    'pdfconvert_pdfs_total': ('counter', "処理したPDFの件数"),
+    'pdfconvert_pdf_fallback_total': ('counter', "PyPDF2のフォールバック処理を使用したPDFの件数"),
+    'pdfconvert_pdf_cache_hits_total': ('counter', "抽出キャッシュにヒットしたPDFの件数"),
+    'pdfconvert_pdf_cache_misses_total': ('counter', "抽出キャッシュにヒットしなかったPDFの件数"),
+    'pdfconvert_peak_rss_bytes': ('gauge', "変換を実行したプロセスのピークRSS（複数プロセスの場合は最大値）"),
+}
+
+
+class ConversionMetrics:
+    """
+    変換ジョブ1件分の計測値
+    段階ごとの所要時間(stage)と件数・バイト数などのカウンター(count)を記録する
+    """
+
+    def __init__(self, job_id=''):
+        self.job_id = job_id
+        self.status = 'done'
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.stages = {}
+        self.rss_growth = {}  # 段階ごとのピークRSSの増加量（バイト）
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        rss_before = peak_rss_bytes()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+            growth = peak_rss_bytes() - rss_before
+            if growth:
+                self.rss_growth[name] = self.rss_growth.get(name, 0) + growth
+
+    def add_time(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def finish(self, status):
+        self.status = status
+        self.duration = time.time() - self.started_at
+
+    def as_dict(self):
+        return {
+            'event': 'conversion',
+            'job_id': self.job_id,
+            'status': self.status,
+            'duration_seconds': round(self.duration, 4),
+            'stages': {name: round(seconds, 4) for name, seconds in self.stages.items()},
+            'rss_growth_mb': {name: round(value / 1024 / 1024, 1) for name, value in self.rss_growth.items()},
+            'peak_rss_mb': round(peak_rss_bytes() / 1024 / 1024, 1),
+            **self.counters,
+        }
+
+
+class MetricsRegistry:
+    """
+    プロセス内のメトリクスを集計し、Prometheusのテキスト形式で出力する
+    metrics_dirを指定した場合は各プロセスの値をファイルに書き出し、出力時に全プロセス分を合算する
+    """
+
+    def __init__(self, metrics_dir=METRICS_DIR):
+        self.metrics_dir = metrics_dir
+        self._series = {}  # 系列名（ラベル込み） -> 値
+        self._lock = threading.Lock()
+        if self.metrics_dir:
+            os.makedirs(self.metrics_dir, exist_ok=True)
+
+    def _inc(self, series, value=1):
+        self._series[series] = self._series.get(series, 0) + value
+
+    def record(self, metrics):
+        """変換1件分の計測値を集計に加え、JSON形式のログを1行出力する"""
+        with self._lock:
+            self._inc(f'pdfconvert_conversions_total{{status="{metrics.status}"}}')
+            for bound in DURATION_BUCKETS:
+                self._inc(f'pdfconvert_conversion_duration_seconds_bucket{{le="{bound}"}}',
+                          1 if metrics.duration <= bound else 0)
+            self._inc('pdfconvert_conversion_duration_seconds_bucket{le="+Inf"}')
+            self._inc('pdfconvert_conversion_duration_seconds_sum', metrics.duration)
+            self._inc('pdfconvert_conversion_duration_seconds_count')
+            for name, seconds in metrics.stages.items():
+                self._inc(f'pdfconvert_stage_duration_seconds_sum{{stage="{name}"}}', seconds)
+                self._inc(f'pdfconvert_stage_duration_seconds_count{{stage="{name}"}}')
+            for name, value in metrics.counters.items():
+                self._inc(f'pdfconvert_{name}_total', value)
+            self._series['pdfconvert_peak_rss_bytes'] = peak_rss_bytes()
+            if self.metrics_dir:
+                self._write_process_file()
+
+        print(json.dumps(metrics.as_dict(), ensure_ascii=False), flush=True)
+
+    def _write_process_file(self):
+        path = os.path.join(self.metrics_dir, f"{os.getpid()}.json")
+        fd, tmp_path = tempfile.mkstemp(dir=self.metrics_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self._series, f)
+        os.replace(tmp_path, path)
+
+    def collect(self):
+        """全プロセス分（metrics_dir未設定の場合はこのプロセス分）の系列を合算して返す"""
+        with self._lock:
+            if not self.metrics_dir:
+                return dict(self._series)
+        totals = {}
+        for entry in os.scandir(self.metrics_dir):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                with open(entry.path) as f:
+                    series = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for key, value in series.items():
+                if METRIC_FAMILIES.get(_family(key), ('',))[0] == 'gauge':
+                    totals[key] = max(totals.get(key, 0), value)
+                else:
+                    totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def render(self):
+        """Prometheusのテキスト形式で出力する"""
+        series = self.collect()
+        lines = []
+        for family, (metric_type, help_text) in METRIC_FAMILIES.items():
+            members = [key for key in series if _family(key) == family]
+            if not members:
+                continue
+            lines.append(f"# HELP {family} {help_text}")
+            lines.append(f"# TYPE {family} {metric_type}")
+            for key in members:
+                lines.append(f"{key} {_format_value(series[key])}")
+        return '\n'.join(lines) + '\n'
+
+
+def _family(series_key):
+    # 系列名からラベルとヒストグラム・サマリーの接尾辞を除いたメトリクス名を返す
+    name = series_key.split('{', 1)[0]
+    for suffix in ('_bucket', '_sum', '_count'):
+        if name.endswith(suffix) and name[:-len(suffix)] in METRIC_FAMILIES:
+            return name[:-len(suffix)]
+    return name
+
+
+def peak_rss_bytes():
+    """このプロセスのピークRSS（バイト）を返す（Linuxのru_maxrssはKB単位）"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+@contextmanager
+def profile_to(path):
+    """ブロック内の処理をcProfileで計測し、結果をpathに保存する（pstatsで読み込める形式）"""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        profiler.dump_stats(path)
@@ -0,0 +1,629 @@
+import hashlib
+import io
+import json
+import mmap
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from extraction_cache import ExtractionCache
+from header_parser import parse_page_header
+
+# PDF処理用ライブラリ
+try:
+    import pdfplumber  # 表構造を保持したPDF処理に最適
+    from pdfplumber.table import TableSettings
+    from pdfplumber.utils import extract_text as chars_to_text
+    PDFPLUMBER_AVAILABLE = True
+except ImportError:
+    PDFPLUMBER_AVAILABLE = False
+
+# フォールバック用にPyPDF2も保持（pdfplumberで処理できなかったPDFにも使用する）
+try:
+    from PyPDF2 import PdfReader
+except ImportError:
+    from PyPDF2 import PdfFileReader as PdfReader
+
+# 抽出処理のバージョン（page_dataの内容が変わる修正をした場合は上げる。キャッシュキーに使用）
+EXTRACTOR_VERSION = 2
+
+# --- 抽出内容の設定 ---
+# 表検出の設定（pdfplumberのtable_settingsをJSONで指定。未指定の場合はpdfplumberの既定値）
+# 例: 罫線（line）だけで表を判定する軽い設定
+#     PDF_TABLE_SETTINGS='{"vertical_strategy": "lines_strict", "horizontal_strategy": "lines_strict"}'
+PDF_TABLE_SETTINGS = json.loads(os.environ.get('PDF_TABLE_SETTINGS') or '{}')
+# 表の範囲内の文字を「その他のテキスト」から除外する場合は1
+PDF_TEXT_EXCLUDE_TABLES = os.environ.get('PDF_TEXT_EXCLUDE_TABLES', '0') == '1'
+# 罫線の数から表がありえないと判定したページで表の検出を省略する場合は1（既定）
+PDF_TABLE_PRECHECK = os.environ.get('PDF_TABLE_PRECHECK', '1') == '1'
+# 設定によって抽出結果が変わるため、キャッシュキーには設定も含める
+EXTRACTION_SETTINGS_VERSION = f"{EXTRACTOR_VERSION}." + hashlib.sha256(json.dumps(
+    [PDF_TABLE_SETTINGS, PDF_TEXT_EXCLUDE_TABLES, PDF_TABLE_PRECHECK], sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+# page_data['extraction_path'] の値
+EXTRACTION_PATH_TABLE = 'table'          # pdfplumberで表の検出とテキスト抽出を行った
+EXTRACTION_PATH_TEXT_ONLY = 'text_only'  # 罫線がないため表の検出を省略し、テキストのみ抽出した
+EXTRACTION_PATH_FALLBACK = 'fallback'    # PyPDF2でテキストのみ抽出した
+
+# --- 並列抽出の設定 ---
+# プロセスプールのワーカー数（0または1の場合はリクエスト処理中のプロセスで逐次実行）
+PDF_WORKERS = int(os.environ.get('PDF_WORKERS', os.cpu_count() or 1))
+# 1タスクあたりに処理するページ数（小さすぎるとPDFを開き直すコストが増える）
+PDF_PAGES_PER_TASK = max(1, int(os.environ.get('PDF_PAGES_PER_TASK', 8)))
+# 結果を回収する前に投入しておくタスク数の上限（未回収の結果が保持されるメモリの上限になる）
+PDF_PREFETCH_TASKS = max(1, int(os.environ.get('PDF_PREFETCH_TASKS', 2 * max(PDF_WORKERS, 1))))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# 同じPDFの再アップロード時に抽出をやり直さないためのキャッシュ
+extraction_cache = ExtractionCache()
+
+
+def get_executor():
+    """
+    PDF抽出用のプロセスプールを返す（初回呼び出し時に生成）
+    PDF_WORKERSが1以下の場合はNoneを返し、逐次処理を行う
+    """
+    global _executor
+    if PDF_WORKERS <= 1:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=PDF_WORKERS)
+        return _executor
+
+
+def shutdown_executor(executor=None):
+    """
+    プロセスプールを停止する（ワーカーが異常終了した場合の再生成にも使用）
+    executorを指定した場合は、それが現在のプロセスプールである場合のみ停止する（他のジョブが作り直したプールは止めない）
+    投入済みのタスクは取り消さない（同じプールを使っている他のジョブのタスクを巻き込まないため）
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None or (executor is not None and _executor is not executor):
+            return
+        target, _executor = _executor, None
+    target.shutdown(wait=False)
+
+
+def _clean_table(table):
+    """
+    pdfplumberが返した表データを整形する
+    Noneのセルは空文字に、セル内の改行は空白に置き換える
+    """
+    clean_table = []
+    for row in table:
+        if row:  # 行が空でない場合
+            clean_row = []
+            for cell in row:
+                # セルの内容を文字列として処理
+                if cell is not None:
+                    # 改行や余分な空白を整理
+                    clean_row.append(str(cell).strip().replace('\n', ' '))
+                else:
+                    clean_row.append('')  # 空のセル
+            clean_table.append(clean_row)
+    return clean_table
+
+
+def _extract_page(page, page_num, timings):
+    """
+    pdfplumberのページ1枚から表とテキストを抽出し、page_dataを返す
+    ページの文字・罫線は一度だけ解析し、表の検出・セルの文字列・表以外のテキストのすべてに使い回す
+    timingsには処理ごとの所要時間（秒）を加算する
+    """
+    page_data = {
+        'page_number': page_num + 1,
+        'tables': [],
+        'text': ''
+    }
+
+    # ページのオブジェクト（文字・罫線・矩形）を解析する
+    start = time.perf_counter()
+    chars = page.chars
+    _add_timing(timings, 'layout', start)
+
+    # 罫線の数を確認し、表がありえないページでは表の検出を省略する
+    start = time.perf_counter()
+    table_settings = TableSettings.resolve(PDF_TABLE_SETTINGS)
+    detect_tables = not PDF_TABLE_PRECHECK or _may_have_table(page, table_settings)
+    page_data['extraction_path'] = EXTRACTION_PATH_TABLE if detect_tables else EXTRACTION_PATH_TEXT_ONLY
+    _add_timing(timings, 'table_precheck', start)
+
+    # ページから表を検出
+    start = time.perf_counter()
+    tables = page.find_tables(table_settings) if detect_tables else []
+    _add_timing(timings, 'table_detection', start)
+
+    # 検出した表のセルの文字列を取り出す
+    start = time.perf_counter()
+    char_mids = [((char['x0'] + char['x1']) / 2, (char['top'] + char['bottom']) / 2) for char in chars]
+    text_settings = table_settings.text_settings or {}
+    for table_idx, table in enumerate(tables):
+        table_rows = _table_rows(table, chars, char_mids, text_settings)
+        if table_rows:
+            clean_table = _clean_table(table_rows)
+            if clean_table:  # 空でない表のみ保存
+                page_data['tables'].append({
+                    'table_index': table_idx,
+                    'data': clean_table
+                })
+    _add_timing(timings, 'table_extraction', start)
+
+    # 表以外のテキストも抽出（補足情報として）
+    start = time.perf_counter()
+    if PDF_TEXT_EXCLUDE_TABLES and tables:
+        # 表の範囲内の文字は表として出力済みのため、テキストからは除く
+        bboxes = [table.bbox for table in tables]  # 参照のたびに計算されるため先に取得する
+        page_text = page.filter(lambda obj: obj.get('object_type') != 'char' or not any(
+            _in_bbox(((obj['x0'] + obj['x1']) / 2, (obj['top'] + obj['bottom']) / 2), bbox)
+            for bbox in bboxes)).extract_text()
+    else:
+        page_text = page.extract_text()
+    if page_text:
+        # 改行を適切に処理
+        page_data['text'] = page_text.strip().replace('\r\n', '\n').replace('\r', '\n')
+    _add_timing(timings, 'text_extraction', start)
+
+    start = time.perf_counter()
+    _add_header_fields(page_data)
+    _add_timing(timings, 'header_parse', start)
+    return page_data
+
+
+def _may_have_table(page, table_settings):
+    """
+    罫線（line・rect・curve）の数から、表の検出で表が見つかる可能性があるかどうかを判定する
+    罫線で表を判定する設定（lines / lines_strict）の場合、セルを作るには横線と縦線が2本ずつ以上必要になる
+    pdfplumberと同じく水平でない線は縦線として数え、rectは横線2本・縦線2本として数える
+    判定できない設定（text戦略や明示的な罫線の指定）の場合は常にTrueを返す
+    """
+    strategies = {table_settings.vertical_strategy, table_settings.horizontal_strategy}
+    if not strategies <= {'lines', 'lines_strict'}:
+        return True
+    if table_settings.explicit_vertical_lines or table_settings.explicit_horizontal_lines:
+        return True
+
+    horizontal = vertical = 0
+    for line in page.lines:
+        if line['top'] == line['bottom']:
+            horizontal += 1
+        else:
+            vertical += 1
+    if 'lines' in strategies:
+        if page.curves:
+            return True  # 曲線は複数の辺になりうるため、数えずに表の検出を行う
+        horizontal += 2 * len(page.rects)
+        vertical += 2 * len(page.rects)
+    return horizontal >= 2 and vertical >= 2
+
+
+def _in_bbox(mid, bbox):
+    # 文字の中心が範囲内にあるかどうか（pdfplumberのTable.extractと同じ判定）
+    x0, top, x1, bottom = bbox
+    return x0 <= mid[0] < x1 and top <= mid[1] < bottom
+
+
+def _table_rows(table, chars, char_mids, text_settings):
+    """
+    表の各セルの文字列を返す（pdfplumberのTable.extractと同じ結果）
+    文字の中心座標は呼び出し側で一度だけ計算し、表の範囲内の文字を縦位置で並べ替えておくことで
+    行ごとに全文字を走査せず、二分探索でその行の文字だけを取り出す
+    """
+    if 'layout' in text_settings:
+        return table.extract(**text_settings)
+
+    table_bbox = table.bbox  # 参照のたびに全セルから計算されるため一度だけ取得する
+    table_chars = sorted(
+        (mid[1], index, mid) for index, mid in enumerate(char_mids) if _in_bbox(mid, table_bbox))
+    v_mids = [v_mid for v_mid, _, _ in table_chars]
+
+    rows = []
+    for row in table.rows:
+        x0, top, x1, bottom = row.bbox
+        # セル内の文字は元の（ページ内の）順序で渡す
+        row_chars = sorted(
+            (index, mid) for _, index, mid in table_chars[bisect_left(v_mids, top):bisect_left(v_mids, bottom)]
+            if x0 <= mid[0] < x1)
+        cells = []
+        for cell in row.cells:
+            if cell is None:
+                cells.append(None)
+                continue
+            cell_chars = [chars[index] for index, mid in row_chars if _in_bbox(mid, cell)]
+            cells.append(chars_to_text(cell_chars, **text_settings) if cell_chars else "")
+        rows.append(cells)
+    return rows
+
+
+def _add_timing(timings, name, start):
+    timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def _add_header_fields(page_data):
+    """
+    page_dataにタイトル・名前・役割を追加する
+    page_data['text']は抽出に使用されなかった残りのテキストに置き換える
+    """
+    title, name, role, remaining_text = parse_page_header(page_data['text'])
+    page_data['title'] = title
+    page_data['name'] = name
+    page_data['role'] = role
+    page_data['text'] = remaining_text
+    return page_data
+
+
+def _iter_page_range(pdf_path, start, stop, timings):
+    """
+    PDFのstart〜stop-1ページ目を1ページずつ抽出して返すジェネレーター
+    抽出が終わったページはキャッシュ（pdfminerのレイアウトオブジェクトなど）をすぐに解放する
+    """
+    with pdfplumber.open(pdf_path) as pdf:
+        for i in range(start, stop):
+            page = pdf.pages[i]
+            try:
+                yield _extract_page(page, i, timings)
+            finally:
+                _release_page(page)
+
+
+def _release_page(page):
+    """抽出が終わったページのキャッシュを解放する"""
+    if hasattr(page, 'close'):
+        page.close()  # flush_cacheに加えてget_textmapのキャッシュも破棄する
+    else:
+        # Page.closeがない0.10系では、ページごとのget_textmapのlru_cacheを別に破棄する
+        # （pdf.pagesが全ページを保持しているため、残しておくとページ数に比例してメモリが増える）
+        page.flush_cache()
+        page.get_textmap.cache_clear()
+
+
+def _extract_page_range(pdf_path, start, stop):
+    """
+    プロセスプールのワーカーで実行される関数
+    一時ファイルからPDFを開き直し、start〜stop-1ページ目を抽出する
+    戻り値: (page_dataのリスト, 処理ごとの所要時間)
+    """
+    timings = {}
+    pages = list(_iter_page_range(pdf_path, start, stop, timings))
+    return pages, timings
+
+
+def _count_pages(pdf_path):
+    with pdfplumber.open(pdf_path) as pdf:
+        return len(pdf.pages)
+
+
+def source_size(source):
+    """PDF・Excelの入力（バイト列またはファイルのパス）のバイト数を返す"""
+    return len(source) if isinstance(source, (bytes, bytearray)) else os.path.getsize(source)
+
+
+def _source_key(source):
+    """
+    PDFのキャッシュキーを返す
+    ファイルのパスの場合はmmapで読み、ファイル全体をメモリにコピーせずにハッシュを計算する
+    """
+    if isinstance(source, (bytes, bytearray)) or not os.path.getsize(source):
+        data = source if isinstance(source, (bytes, bytearray)) else b''
+        return ExtractionCache.make_key(data, EXTRACTION_SETTINGS_VERSION)
+    with open(source, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return ExtractionCache.make_key(data, EXTRACTION_SETTINGS_VERSION)
+
+
+def iter_pdf_pages(pdf_sources, progress=None, metrics=None, use_cache=True):
+    """
+    複数のPDFを抽出し、(PDFの番号, page_data) をPDF順・ページ順に1ページずつ返すジェネレーター
+    pdf_sourcesは (PDFのバイト列またはファイルのパス, filename) のリスト
+    キャッシュにないPDFのページはプロセスプールに分配し、先読みするタスク数はPDF_PREFETCH_TASKSまでに抑える
+    progressを指定した場合はページ数が分かった時点で総ページ数(add_total)を報告する
+    metricsを指定した場合はキャッシュの利用状況と処理ごとの所要時間を記録する
+    """
+    keys = [_source_key(source) for source, _ in pdf_sources]
+    cached = [extraction_cache.get(key) if use_cache else None for key in keys]
+
+    missing = [i for i, pages in enumerate(cached) if pages is None]
+    if metrics is not None:
+        metrics.count('pdfs', len(pdf_sources))
+        metrics.count('pdf_cache_hits', len(pdf_sources) - len(missing))
+        metrics.count('pdf_cache_misses', len(missing))
+
+    uncached = _iter_uncached([pdf_sources[i] for i in missing], progress, metrics)
+    try:
+        for source_index, pages in enumerate(cached):
+            if pages is not None:
+                if progress is not None:
+                    progress.add_total(len(pages))
+                for page_data in pages:
+                    _count_path(metrics, page_data)
+                    yield source_index, page_data
+                continue
+
+            # キャッシュにないPDFは抽出しながら返し、完了したらキャッシュに保存する
+            buffer = _CacheBuffer(keys[source_index]) if use_cache else None
+            for page_data, cacheable in uncached:
+                if page_data is None:  # このPDFの終わり
+                    if buffer is not None and cacheable:
+                        buffer.commit()
+                    break
+                if buffer is not None:
+                    buffer.add(page_data)
+                _count_path(metrics, page_data)
+                yield source_index, page_data
+    finally:
+        # 途中で読むのをやめた場合も、一時ファイルの削除と未実行タスクの取り消しを行う
+        uncached.close()
+
+
+def _count_path(metrics, page_data):
+    # ページごとの抽出方法（表の検出あり / テキストのみ / フォールバック）を数える
+    if metrics is not None:
+        metrics.count(f"pages_{page_data['extraction_path']}")
+
+
+class _CacheBuffer:
+    """
+    抽出中のPDFのページをキャッシュ用のJSONとして貯め、抽出完了時にキャッシュへ保存する
+    page_data自体は保持しないため、貯める量はシリアライズ後のバイト数のみ
+    キャッシュの上限（ディスクにも保存する場合は、メモリとディスクの上限の大きい方）を超える大きさになった場合は保存しない
+    フォールバック処理したページを含むPDFも保存しない
+    （一時的な失敗による結果を残さないため。エラーのページには利用者が付けたファイル名が含まれ、
+    同じ内容のPDFを別の名前でアップロードした利用者にそのファイル名が見えてしまうため）
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.parts = []
+        self.size = 0
+        self.enabled = True
+        # ディスクにも保存する場合は、メモリに載らない大きさでもディスクの上限までは保存する
+        self.limit = extraction_cache.max_bytes
+        if extraction_cache.cache_dir:
+            self.limit = max(self.limit, extraction_cache.dir_max_bytes)
+
+    def add(self, page_data):
+        if not self.enabled:
+            return
+        if page_data['extraction_path'] == EXTRACTION_PATH_FALLBACK:
+            self.enabled = False
+            self.parts = []
+            return
+        part = json.dumps(page_data, ensure_ascii=False).encode('utf-8')
+        self.size += len(part) + 1
+        if self.size > self.limit:
+            self.enabled = False
+            self.parts = []
+            return
+        self.parts.append(part)
+
+    def commit(self):
+        if self.enabled and self.parts:
+            extraction_cache.put_payload(self.key, b'[' + b','.join(self.parts) + b']')
+        self.parts = []
+
+
+def _iter_uncached(pdf_sources, progress=None, metrics=None):
+    """
+    キャッシュにないPDFを順に抽出するジェネレーター
+    各ページについて (page_data, None) を返し、PDFの終わりごとに (None, キャッシュしてよいか) を返す
+    ワーカーの異常終了など、PDFの中身に依らない失敗を含む結果はキャッシュしない
+
+    プロセスプールは同時に実行中の他のジョブと共有する
+    ワーカーが1つでも異常終了するとプール全体が使えなくなり、どのタスクが原因かは分からないため、
+    投入済みのタスクはすべて作り直したプールで再実行する
+    再実行は原因を特定するため、このジョブ専用の1プロセスのプールで1タスクずつ行い、
+    そこでもワーカーを異常終了させたタスクのページだけをフォールバック処理する（他のジョブや同じPDFの他のページは巻き込まない）
+    """
+    if not PDFPLUMBER_AVAILABLE:
+        # pdfplumberが利用できない場合のフォールバック
+        for source, filename in pdf_sources:
+            if metrics is not None:
+                metrics.count('pdf_fallback')
+            for page_data in iter_pdf_fallback(source, filename):
+                if progress is not None:
+                    progress.add_total(1)
+                yield page_data, None
+            yield None, True
+        return
+
+    executor = get_executor()
+    pdf_paths = []
+    temp_paths = []
+    tasks = deque()     # 未投入のタスク (PDFの番号, 開始ページ, 終了ページ)
+    in_flight = deque()  # 投入済みのタスクとそのFuture
+    uncacheable = set()  # キャッシュしないPDFの番号（プロセスプールの異常の影響を受けた・抽出方法が混在する）
+    suspects = {}        # 共有のプールの異常終了時に投入済みだったタスク（原因の候補。dictは順序を保つ集合として使う）
+    isolation = None     # 原因の候補を1つずつ実行する、このジョブ専用のプロセスプール
+    try:
+        # ワーカーはファイルのパスからPDFを開き直す（バイト列で渡されたPDFは一時ファイルへ書き出す）
+        page_counts = []
+        for n, (source, filename) in enumerate(pdf_sources):
+            if isinstance(source, (bytes, bytearray)):
+                with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp:
+                    tmp.write(source)
+                temp_paths.append(tmp.name)
+                pdf_paths.append(tmp.name)
+            else:
+                pdf_paths.append(source)
+
+            try:
+                page_count = _count_pages(pdf_paths[n])
+            except Exception as e:
+                print(f"pdfplumberでの処理中にエラーが発生: {e}")
+                page_counts.append(None)
+                continue
+
+            page_counts.append(page_count)
+            if progress is not None:
+                progress.add_total(page_count)
+            # 逐次処理の場合はPDFを開き直さないよう、1つのタスクで全ページを処理する
+            step = PDF_PAGES_PER_TASK if executor is not None else max(page_count, 1)
+            tasks.extend((n, start, min(start + step, page_count)) for start in range(0, page_count, step))
+
+        def fill():
+            # 先読みするタスク数を制限し、未回収の結果がメモリに溜まらないようにする
+            nonlocal isolation
+            while tasks and len(in_flight) < PDF_PREFETCH_TASKS:
+                task = tasks[0]
+                if task in suspects:
+                    # 異常終了の原因の候補は、このジョブ専用の1プロセスのプールで1つずつ実行する
+                    if any(item[0] in suspects for item in in_flight):
+                        return
+                    if isolation is None:
+                        isolation = ProcessPoolExecutor(max_workers=1)
+                    pool = isolation
+                elif executor is not None:
+                    pool = executor
+                else:
+                    return
+                tasks.popleft()
+                try:
+                    future = pool.submit(_extract_page_range, pdf_paths[task[0]], *task[1:])
+                except RuntimeError as e:
+                    # 異常終了したプール（BrokenProcessPool）や、停止済みのプールには投入できない
+                    tasks.appendleft(task)
+                    if pool is isolation:
+                        isolation.shutdown(wait=False)
+                        isolation = None
+                    else:
+                        uncacheable.add(task[0])
+                        recover_pool(e)
+                    continue
+                in_flight.append((task, future))
+
+        def recover_pool(error):
+            # 共有のプロセスプールを作り直し、投入済みのタスクを未投入に戻す
+            # （異常終了の場合は、どのタスクが原因か分からないため、すべて原因の候補として1つずつ再実行する）
+            nonlocal executor
+            print(f"PDF抽出のプロセスプールが使用できなくなりました: {error!r}")
+            requeue = [task for task, _ in in_flight]
+            in_flight.clear()
+            if isinstance(error, BrokenProcessPool):
+                suspects.update(dict.fromkeys(requeue))
+            uncacheable.update(task[0] for task in requeue)
+            tasks.extendleft(reversed(requeue))
+            shutdown_executor(executor)
+            executor = get_executor()
+
+        # PDF順・ページ順に結果を返す
+        for n, (source, filename) in enumerate(pdf_sources):
+            if page_counts[n] is None:
+                # ページ数も取得できないPDFは全体をフォールバック処理する
+                if metrics is not None:
+                    metrics.count('pdf_fallback')
+                for page_data in iter_pdf_fallback(source, filename):
+                    if progress is not None:
+                        progress.add_total(1)
+                    yield page_data, None
+                yield None, True
+                continue
+
+            next_page = 0
+            try:
+                while next_page < page_counts[n]:
+                    fill()
+                    if in_flight and in_flight[0][0][0] == n:
+                        task, future = in_flight[0]
+                        _, start, stop = task
+                        try:
+                            pages, timings = future.result()
+                        except (BrokenProcessPool, CancelledError) as e:
+                            if task not in suspects:
+                                recover_pool(e)
+                                continue  # 作り直したプールで再実行する
+                            # 専用のプールで単独で実行してもワーカーが異常終了したため、このタスクのページだけフォールバック処理する
+                            print(f"PDF '{filename}' の{start + 1}〜{stop}ページ目の抽出でワーカーが異常終了しました: {e!r}")
+                            in_flight.popleft()
+                            suspects.pop(task)
+                            isolation.shutdown(wait=False)
+                            isolation = None
+                            if metrics is not None:
+                                metrics.count('pdf_fallback')
+                            for page_data in iter_pdf_fallback(source, filename, start_page=start, stop_page=stop):
+                                yield page_data, None
+                            next_page = stop
+                            continue
+                        in_flight.popleft()
+                        suspects.pop(task, None)
+                    else:
+                        # プロセスプールを使用しない場合は、このプロセスで1ページずつ抽出する
+                        _, start, stop = tasks.popleft()
+                        timings = {}
+                        pages = _iter_page_range(pdf_paths[n], start, stop, timings)
+                    for page_data in pages:
+                        yield page_data, None
+                        next_page = page_data['page_number']
+                    next_page = stop
+                    if metrics is not None:
+                        for name, seconds in timings.items():
+                            metrics.add_time(name, seconds)
+            except Exception as e:
+                print(f"pdfplumberでの処理中にエラーが発生: {e}")
+                # 既に返したページはそのままにし、残りのページをフォールバック処理する
+                _discard_tasks(n, tasks, in_flight)
+                if metrics is not None:
+                    metrics.count('pdf_fallback')
+                for page_data in iter_pdf_fallback(source, filename, start_page=next_page):
+                    yield page_data, None
+                if next_page:
+                    # pdfplumberとPyPDF2の結果が混在するためキャッシュしない
+                    uncacheable.add(n)
+            yield None, n not in uncacheable
+    finally:
+        for _, future in in_flight:
+            future.cancel()
+        if isolation is not None:
+            isolation.shutdown(wait=False)
+        for path in temp_paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _discard_tasks(n, tasks, in_flight):
+    """n番目のPDFの未処理のタスクを取り除く（投入済みのものは取り消す）"""
+    for task in [task for task in tasks if task[0] == n]:
+        tasks.remove(task)
+    for item in [item for item in in_flight if item[0][0] == n]:
+        item[1].cancel()
+        in_flight.remove(item)
+
+
+def iter_pdf_fallback(source, filename, start_page=0, stop_page=None):
+    """
+    PyPDF2でstart_page番目（0始まり）以降のページ（stop_pageを指定した場合はその手前まで）を1ページずつ抽出するジェネレーター
+    sourceはPDFのバイト列またはファイルのパス
+    """
+    page_num = start_page
+    try:
+        pdf_reader = PdfReader(io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source)
+        page_total = len(pdf_reader.pages)
+        for page_num in range(start_page, page_total if stop_page is None else min(stop_page, page_total)):
+            page = pdf_reader.pages[page_num]
+            text = page.extract_text()
+
+            page_data = {
+                'page_number': page_num + 1,
+                'tables': [],
+                'text': text.strip() if text else f"[ページ {page_num + 1}: テキストを抽出できませんでした]",
+                'extraction_path': EXTRACTION_PATH_FALLBACK
+            }
+            yield _add_header_fields(page_data)
+
+    except Exception as e:
+        print(f"PyPDF2での処理中にエラーが発生: {e}")
+        # 最後の手段として空のページデータを返す
+        yield _add_header_fields({
+            'page_number': page_num + 1,
+            'tables': [],
+            'text': f"[エラー: {filename} を処理できませんでした - {str(e)}]",
+            'extraction_path': EXTRACTION_PATH_FALLBACK
+        })
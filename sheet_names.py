@@ -0,0 +1,56 @@
+import os
+import re
+
+# Excelのシート名の上限文字数
+SHEET_TITLE_MAX_CHARS = 31
+# シート名に使用できない文字
+INVALID_TITLE_PATTERN = re.compile(r'[\\/*?:\[\]]')
+
+# ページのシート名の形式（{page}はページ番号、{stem}はPDFのファイル名から拡張子を除いたもの）
+# 例: 'Page_{page}'（既定）、'{stem}_P{page}'
+SHEET_NAME_SCHEME = os.environ.get('SHEET_NAME_SCHEME', 'Page_{page}')
+
+
+class SheetNameAllocator:
+    """
+    ワークブック全体で重複しないシート名を割り当てるクラス
+    使用済みのシート名の集合と、基本名ごとの次の連番を保持し、1ページあたり定数時間で名前を決める
+    同名のシートがある場合は「基本名_1」「基本名_2」…の形式にする
+    Excelと同様に大文字・小文字は区別せずに重複を判定する
+    """
+
+    def __init__(self, used_titles=(), scheme=SHEET_NAME_SCHEME):
+        self.scheme = scheme
+        self._used = {title.casefold() for title in used_titles}
+        self._next_suffix = {}  # 基本名 -> 次に試す連番
+
+    def allocate(self, page_number, pdf_filename=''):
+        """ページのシート名を決めて使用済みにし、その名前を返す"""
+        stem = os.path.splitext(os.path.basename(pdf_filename))[0]
+        base = self._base_name(page_number, stem, SHEET_TITLE_MAX_CHARS)
+
+        title = base
+        if title.casefold() in self._used:
+            key = base.casefold()
+            counter = self._next_suffix.get(key, 1)
+            while True:
+                suffix = f"_{counter}"
+                # 連番を付けても31文字に収まるように基本名を切り詰める
+                title = self._base_name(page_number, stem, SHEET_TITLE_MAX_CHARS - len(suffix)) + suffix
+                counter += 1
+                if title.casefold() not in self._used:
+                    break
+            self._next_suffix[key] = counter
+
+        self._used.add(title.casefold())
+        return title
+
+    def _base_name(self, page_number, stem, max_chars):
+        """形式に従った基本名を返す（長すぎる場合はページ番号が残るようにPDF名の部分から切り詰める）"""
+        name = self._format(page_number, stem)
+        if len(name) > max_chars and stem:
+            name = self._format(page_number, stem[:max(0, len(stem) - (len(name) - max_chars))])
+        return name[:max_chars] or f"Page_{page_number}"[:max_chars]
+
+    def _format(self, page_number, stem):
+        return INVALID_TITLE_PATTERN.sub('_', self.scheme.format(page=page_number, stem=stem)).strip("'")
@@ -154,10 +154,19 @@ document.addEventListener('DOMContentLoaded', () => {
             // loadingOverlay.classList.add('hidden'); // 削除
 
             if (response.ok) {
-                const blob = await response.blob();
+                // 変換はサーバー側のジョブとして実行されるので、完了するまで状態を確認する
+                const job = await response.json();
+                const state = await waitForJob(job.status_url);
+                if (state.status === 'error') {
+                    window.location.href = `/error?message=${encodeURIComponent(state.message)}`;
+                    return;
+                }
+
+                const downloadResponse = await fetch(job.download_url);
+                const blob = await downloadResponse.blob();
                 const url = window.URL.createObjectURL(blob);
-                const disposition = response.headers.get('Content-Disposition');
-                let filename = 'processed_data.xlsx';
+                const disposition = downloadResponse.headers.get('Content-Disposition');
+                let filename = state.download_name || 'processed_data.xlsx';
                 if (disposition && disposition.indexOf('attachment') !== -1) {
                     const filenameRegex = /filename[^;=\n]*=((['"]).*?\2|[^;\n]*)/;
                     const matches = filenameRegex.exec(disposition);
@@ -195,5 +204,25 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    // --- ジョブの完了待ち ---
+    async function waitForJob(statusUrl) {
+        // サーバー側で停止を検出できなかった場合に待ち続けないよう、最大30分で打ち切る
+        const deadline = Date.now() + 30 * 60 * 1000;
+        while (true) {
+            if (Date.now() > deadline) {
+                return { status: 'error', message: '処理が時間内に完了しませんでした。時間をおいてもう一度お試しください。' };
+            }
+            const response = await fetch(statusUrl);
+            if (!response.ok) {
+                throw new Error(`status ${response.status}`);
+            }
+            const state = await response.json();
+            if (state.status === 'done' || state.status === 'error') {
+                return state;
+            }
+            await new Promise(resolve => setTimeout(resolve, 1000));
+        }
+    }
+
     updateFileList(); // 初期表示でボタンの状態を更新
 });
@@ -0,0 +1,80 @@
+import io
+import os
+import pickle
+import threading
+import zipfile
+
+from openpyxl import load_workbook
+
+
+def find_paste_start_row(sheet):
+    """
+    アップロードされたデータを貼り付ける開始行を求める関数
+    シートが空の場合は1行目、既存データがある場合は最終行から2行空けた位置を返す
+    """
+    # 既存データの最後の行を取得
+    last_row = sheet.max_row if sheet.max_row > 1 else 1
+
+    # 空の行があるかチェック
+    is_empty_template = True
+    for row in range(1, last_row + 1):
+        for col in range(1, sheet.max_column + 1):
+            if sheet.cell(row=row, column=col).value is not None:
+                is_empty_template = False
+                break
+        if not is_empty_template:
+            break
+
+    # データを貼り付ける開始位置を決定
+    if is_empty_template:
+        return 1  # テンプレートが空の場合は1行目から
+    return last_row + 2  # 既存データがある場合は2行空けて貼り付け
+
+
+class TemplateCache:
+    """
+    テンプレート(.xlsm)の解析結果をプロセス内に保持するキャッシュ
+    解析済みのワークブックをpickle化して保持し、リクエストごとに復元して独立したコピーを渡す
+    ファイルの更新日時(mtime)が変わった場合のみ読み込み直す
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stamp = None        # (mtime_ns, size)
+        self._raw_bytes = None    # テンプレートファイルの中身（VBAパーツの複製元）
+        self._snapshot = None     # pickle化したワークブック
+        self._start_row = 1       # 1枚目のシートの貼り付け開始行
+
+    def _file_stamp(self):
+        stat = os.stat(self.path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _load(self, stamp):
+        with open(self.path, 'rb') as f:
+            raw_bytes = f.read()
+
+        workbook = load_workbook(io.BytesIO(raw_bytes), keep_vba=True)
+        start_row = find_paste_start_row(workbook.worksheets[0]) if workbook.worksheets else 1
+
+        # vba_archive(ZipFile)はpickle化できないため外し、コピー時に付け直す
+        workbook.vba_archive = None
+        self._snapshot = pickle.dumps(workbook, protocol=pickle.HIGHEST_PROTOCOL)
+        self._raw_bytes = raw_bytes
+        self._start_row = start_row
+        self._stamp = stamp
+
+    def get(self):
+        """
+        テンプレートの独立したコピーと、1枚目のシートの貼り付け開始行を返す
+        戻り値: (workbook, start_row)
+        """
+        stamp = self._file_stamp()
+        with self._lock:
+            if stamp != self._stamp:
+                self._load(stamp)
+            snapshot, raw_bytes, start_row = self._snapshot, self._raw_bytes, self._start_row
+
+        workbook = pickle.loads(snapshot)
+        workbook.vba_archive = zipfile.ZipFile(io.BytesIO(raw_bytes))
+        return workbook, start_row
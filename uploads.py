@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+import time
+
+# --- アップロードの一時保存の設定 ---
+# アップロードされたファイルを書き出すディレクトリ（リクエストごとにサブディレクトリを作る）
+UPLOAD_DIR = os.environ.get('UPLOAD_DIR') or os.path.join(tempfile.gettempdir(), 'pdfconvert_uploads')
+# 異常終了などで削除されずに残ったアップロードを削除するまでの秒数
+UPLOAD_TTL_SECONDS = int(os.environ.get('UPLOAD_TTL_SECONDS', 6 * 60 * 60))
+
+
+class UploadSpool:
+    """
+    1リクエスト分のアップロードファイルをディスクに書き出して保持するクラス
+    ファイルはメモリに読み込まずにストリームのまま書き出し、変換処理にはパスを渡す
+    変換が終わったらcleanup()でディレクトリごと削除する（withブロックで使用した場合は自動で削除する）
+    """
+
+    def __init__(self, upload_dir=UPLOAD_DIR):
+        os.makedirs(upload_dir, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix='upload_', dir=upload_dir)
+        self._count = 0
+
+    def save(self, file_storage, suffix=''):
+        """アップロードされたファイル（werkzeugのFileStorage）を書き出し、そのパスを返す"""
+        self._count += 1
+        # 元のファイル名は変換結果のシート名などにのみ使い、保存先のパスには使わない
+        path = os.path.join(self.path, f"{self._count:04d}{suffix}")
+        file_storage.save(path)
+        file_storage.close()
+        return path
+
+    def cleanup(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cleanup()
+        return False
+
+
+def cleanup_stale_uploads(upload_dir=UPLOAD_DIR, ttl_seconds=UPLOAD_TTL_SECONDS):
+    """保持期間を過ぎても残っているアップロードのディレクトリを削除する"""
+    expires_before = time.time() - ttl_seconds
+    try:
+        entries = list(os.scandir(upload_dir))
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            if entry.is_dir() and entry.stat().st_mtime < expires_before:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        except OSError:
+            pass
@@ -0,0 +1,293 @@
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape, quoteattr
+
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.utils import get_column_letter
+
+WORKSHEET_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml'
+WORKSHEET_REL_TYPE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet'
+SHEET_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+
+# シートを追加するために書き換えるパーツ（それ以外はテンプレートからそのままコピーする）
+WORKBOOK_PART = 'xl/workbook.xml'
+WORKBOOK_RELS_PART = 'xl/_rels/workbook.xml.rels'
+CONTENT_TYPES_PART = '[Content_Types].xml'
+
+
+class StreamingXlsmWriter:
+    """
+    テンプレートのワークブックに、値だけのシートを逐次追加して保存するライター
+    テンプレート部分（貼り付け済みの1枚目のシートやvbaProject.binを含む）はopenpyxlで一度だけ保存し、
+    追加するシートはセルオブジェクトを作らずにXMLとして直接zipへ書き出す
+    メモリ上に保持するのは書き込み中の1シート分のみ
+    templateにはワークブック、または保存済みのテンプレート部分のファイルパスを指定できる
+    （同じテンプレートから複数のファイルを作る場合に、openpyxlでの保存を1回で済ませるため）
+    """
+
+    # 出力は常に1つのxlsm（ShardedXlsmWriterと同じ属性）
+    is_zip = False
+
+    def __init__(self, template, output):
+        if isinstance(template, str):
+            self._template_file = open(template, 'rb')
+        else:
+            # テンプレート部分をopenpyxlで一時ファイルに保存する
+            self._template_file = tempfile.TemporaryFile()
+            template.save(self._template_file)
+            self._template_file.seek(0)
+        self._source = zipfile.ZipFile(self._template_file)
+
+        self._zip = zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED)
+        self._patched = {}
+        names = self._source.namelist()
+        for name in names:
+            if name in (WORKBOOK_PART, WORKBOOK_RELS_PART, CONTENT_TYPES_PART):
+                self._patched[name] = self._source.read(name).decode('utf-8')
+                continue
+            with self._source.open(name) as src, self._zip.open(name, 'w') as dst:
+                shutil.copyfileobj(src, dst)
+
+        # 追加するシートのファイル番号・sheetId・リレーションIDの採番開始位置
+        self._next_sheet_file = 1 + max(
+            [int(m.group(1)) for m in (re.match(r'xl/worksheets/sheet(\d+)\.xml$', n) for n in names) if m],
+            default=0)
+        self._next_sheet_id = 1 + max(
+            (int(i) for i in re.findall(r'sheetId="(\d+)"', self._patched[WORKBOOK_PART])), default=0)
+        self._next_rel_id = 1 + max(
+            (int(i) for i in re.findall(r'Id="rId(\d+)"', self._patched[WORKBOOK_RELS_PART])), default=0)
+
+        self._sheet_entries = []
+        self._rel_entries = []
+        self._type_entries = []
+        self._closed = False
+
+    def add_sheet(self, title, cells):
+        """
+        シートを1枚追加し、書き込んだセル数を返す
+        cellsは (row, column, value) を行順に返すイテラブル（同じ行の中では列順）
+        """
+        part_name = f"xl/worksheets/sheet{self._next_sheet_file}.xml"
+        rel_id = f"rId{self._next_rel_id}"
+
+        with self._zip.open(part_name, 'w') as stream:
+            stream.write(
+                f'<worksheet xmlns="{SHEET_NS}"><sheetData>'.encode('utf-8'))
+            current_row = None
+            parts = []
+            cell_count = 0
+            for row, column, value in cells:
+                if value is None or value == '':
+                    continue
+                cell_count += 1
+                if row != current_row:
+                    if current_row is not None:
+                        parts.append('</row>')
+                        stream.write(''.join(parts).encode('utf-8'))
+                        parts = []
+                    parts.append(f'<row r="{row}">')
+                    current_row = row
+                parts.append(_cell_xml(f"{get_column_letter(column)}{row}", value))
+            if current_row is not None:
+                parts.append('</row>')
+            parts.append('</sheetData></worksheet>')
+            stream.write(''.join(parts).encode('utf-8'))
+
+        self._sheet_entries.append(
+            f'<sheet name={quoteattr(title)} sheetId="{self._next_sheet_id}" state="visible" r:id="{rel_id}" />')
+        self._rel_entries.append(
+            f'<Relationship Type="{WORKSHEET_REL_TYPE}" Target="/{part_name}" Id="{rel_id}" />')
+        self._type_entries.append(
+            f'<Override PartName="/{part_name}" ContentType="{WORKSHEET_CONTENT_TYPE}" />')
+
+        self._next_sheet_file += 1
+        self._next_sheet_id += 1
+        self._next_rel_id += 1
+        return cell_count
+
+    def close(self):
+        """追加したシートをブック・リレーション・コンテンツタイプに登録して保存を完了する"""
+        if self._closed:
+            return
+        self._closed = True
+        workbook_xml = self._patched[WORKBOOK_PART].replace(
+            '</sheets>', ''.join(self._sheet_entries) + '</sheets>', 1)
+        rels_xml = self._patched[WORKBOOK_RELS_PART].replace(
+            '</Relationships>', ''.join(self._rel_entries) + '</Relationships>', 1)
+        types_xml = self._patched[CONTENT_TYPES_PART].replace(
+            '</Types>', ''.join(self._type_entries) + '</Types>', 1)
+
+        self._zip.writestr(WORKBOOK_PART, workbook_xml)
+        self._zip.writestr(WORKBOOK_RELS_PART, rels_xml)
+        self._zip.writestr(CONTENT_TYPES_PART, types_xml)
+        self._zip.close()
+        self._source.close()
+        self._template_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+        return False
+
+    def discard(self):
+        """保存を完了せずに終了する（書きかけの内容は破棄され、ファイルとしては使えない）"""
+        if self._closed:
+            return
+        self._closed = True
+        self._zip.close()
+        self._source.close()
+        self._template_file.close()
+
+
+class ShardedXlsmWriter:
+    """
+    ページ数またはセル数の上限ごとにテンプレートのコピー（シャード）を分けてシートを書き込むライター
+    StreamingXlsmWriterと同じインターフェースで使用できる
+    シャードが1つだけの場合はそのままxlsmとして、複数の場合は全シャードをまとめたzipとしてoutputに保存する
+
+    テンプレート部分はopenpyxlで一度だけ保存し、各シャードにはそのパーツをコピーする
+    次のシャードのテンプレート部分のコピーと、書き終えたシャードの保存はバックグラウンドのスレッドで行い、
+    ページのシートの書き込みと並行して進める
+    master_workbookを指定した場合は、それをページのシートを含まない master.xlsm として保存し、
+    各シャードはtemplate_workbookから作る
+    """
+
+    def __init__(self, template_workbook, output, max_pages=0, max_cells=0, master_workbook=None):
+        self.output = output
+        self.max_pages = max_pages
+        self.max_cells = max_cells
+        self.is_zip = False
+        self._dir = tempfile.mkdtemp(prefix='xlsm_shards_')
+        self._files = []  # (zip内のファイル名, パス)
+        self._pending = []
+        self._current = None
+        self._next = None
+        self._shard_count = 0
+        self._pages = 0  # 書き込み中のシャードのページ数
+        self._cells = 0  # 書き込み中のシャードのセル数
+        self._closed = False
+        # バックグラウンドの処理は1スレッドで順に行う（シートの書き込みはこのライターを使うスレッドで行う）
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='xlsm_shard')
+        try:
+            self._package = os.path.join(self._dir, 'template.xlsm')
+            template_workbook.save(self._package)
+            if master_workbook is not None:
+                master_path = os.path.join(self._dir, 'master.xlsm')
+                StreamingXlsmWriter(master_workbook, master_path).close()
+                self._files.append(('master.xlsm', master_path))
+        except BaseException:
+            self._cleanup()
+            raise
+
+    def add_sheet(self, title, cells):
+        """
+        シートを1枚追加し、書き込んだセル数を返す
+        追加するとシャードの上限を超える場合は、次のシャードに切り替えてから書き込む
+        """
+        # 上限の判定のために、値のあるセルだけを先に取り出す（1ページ分なので小さい）
+        cells = [cell for cell in cells if cell[2] is not None and cell[2] != '']
+        if self._current is None or (self._pages and (
+                (self.max_pages and self._pages >= self.max_pages)
+                or (self.max_cells and self._cells + len(cells) > self.max_cells))):
+            self._start_next_shard()
+        cell_count = self._current.add_sheet(title, cells)
+        self._pages += 1
+        self._cells += cell_count
+        # 上限の半分まで書き込んだら、次のシャードのテンプレート部分を先に用意しておく
+        if self._next is None and (
+                (self.max_pages and self._pages * 2 >= self.max_pages)
+                or (self.max_cells and self._cells * 2 >= self.max_cells)):
+            self._next = self._executor.submit(self._open_shard, self._shard_count + 1)
+        return cell_count
+
+    def _open_shard(self, index):
+        name = f"part_{index:03d}.xlsm"
+        path = os.path.join(self._dir, name)
+        return name, path, StreamingXlsmWriter(self._package, path)
+
+    def _start_next_shard(self):
+        if self._current is not None:
+            self._pending.append(self._executor.submit(self._current.close))
+        future, self._next = self._next, None
+        self._shard_count += 1
+        name, path, self._current = future.result() if future else self._open_shard(self._shard_count)
+        self._files.append((name, path))
+        self._pages = 0
+        self._cells = 0
+
+    def close(self):
+        """全シャードの保存を完了し、outputにxlsmまたはzipとして書き出す"""
+        if self._closed:
+            return
+        if self._current is None:
+            # ページが1枚もない場合もテンプレートだけのファイルを作る
+            self._start_next_shard()
+        self._current.close()
+        for future in self._pending:
+            future.result()
+        self._closed = True
+        try:
+            if len(self._files) == 1:
+                _, path = self._files[0]
+                if isinstance(self.output, str):
+                    shutil.copyfile(path, self.output)
+                else:
+                    with open(path, 'rb') as src:
+                        shutil.copyfileobj(src, self.output)
+            else:
+                # xlsmは圧縮済みのため、zipには無圧縮で格納する
+                self.is_zip = True
+                with zipfile.ZipFile(self.output, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+                    for name, path in self._files:
+                        archive.write(path, name)
+        finally:
+            self._cleanup()
+
+    def _cleanup(self):
+        if self._next is not None:
+            # 先に用意したが使わなかったシャード
+            try:
+                self._next.result()[2].discard()
+            except Exception:
+                pass
+            self._next = None
+        self._executor.shutdown(wait=True)
+        shutil.rmtree(self._dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif not self._closed:
+            # 失敗した場合は書きかけのシャードを破棄する
+            self._closed = True
+            if self._current is not None:
+                self._current.discard()
+            for future in self._pending:
+                try:
+                    future.result()
+                except Exception:
+                    pass
+            self._cleanup()
+        return False
+
+
+def _cell_xml(coordinate, value):
+    """1セル分のXMLを返す（数値以外はインライン文字列として書き込む）"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c r="{coordinate}"><v>{value}</v></c>'
+    # XMLに使用できない制御文字は除去する
+    text = ILLEGAL_CHARACTERS_RE.sub('', str(value))
+    space = ' xml:space="preserve"' if text != text.strip() else ''
+    return f'<c r="{coordinate}" t="inlineStr"><is><t{space}>{escape(text)}</t></is></c>'